@@ -0,0 +1,258 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Модуль resource недоступен на Windows, пиковая память в этом случае не записывается
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import matplotlib  # noqa: E402
+import parserDiagramsV2 as app  # noqa: E402
+
+
+# Генерация синтетических табличных документов в формате, который ожидает DiagramConstructor.filter_regions:
+# заголовок в первой строке, года во второй строке данных, регионы в колонке A и значения в колонках C, D, E
+class WorkbookGenerator:
+    YEARS = [2024, 2023, 2022]  # Года колонок C, D и E
+
+    # Таблица одного листа: доля нулевых значений и доля выбросов задаются параметрами
+    @staticmethod
+    def make_sheet(rng, regions, outlier_density, zero_density=0.05):
+        values = rng.integers(100, 10000, size=(regions, 3)).astype(float)
+        values[rng.random((regions, 3)) < zero_density] = 0
+        outliers = rng.random((regions, 3)) < outlier_density
+        values[outliers] *= rng.integers(20, 100, size=outliers.sum())
+        rows = [['Синтетический лист', None, None, None, None],
+                [None, None, *WorkbookGenerator.YEARS]]
+        for i in range(regions):
+            rows.append([f'Регион {i + 1}', 'x', *values[i]])
+        return pd.DataFrame(rows, columns=['A', 'B', 'C', 'D', 'E'])
+
+    # Документ .xlsx с несколькими листами "Рис" или .csv с одним листом
+    @staticmethod
+    def generate(path, sheets, regions, outlier_density, seed=0):
+        rng = np.random.default_rng(seed)
+        _, ext = os.path.splitext(path)
+        if ext == '.csv':
+            WorkbookGenerator.make_sheet(rng, regions, outlier_density).to_csv(path, index=False)
+        else:
+            with pd.ExcelWriter(path, engine='openpyxl') as writer:
+                for i in range(sheets):
+                    df = WorkbookGenerator.make_sheet(rng, regions, outlier_density)
+                    df.to_excel(writer, sheet_name=f'Рис {i + 1}', index=False)
+        return path
+
+
+# Замер времени отдельных этапов обработки документа
+class BenchmarkRunner:
+    STAGES = ['discovery', 'load', 'validation', 'filter_regions', 'figure', 'savefig']
+
+    # Пиковое потребление памяти процессом в килобайтах (ru_maxrss на macOS возвращается в байтах).
+    # ru_maxrss - максимум за все время жизни процесса, поэтому каждый прогон выполняется в отдельном процессе
+    @staticmethod
+    def peak_rss_kb():
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+
+    # Прогон одного документа. Этап load включает повторное открытие книги, figure включает
+    # повторный вызов filter_regions внутри build_figure. Диаграммы строятся не более чем
+    # для render_limit листов, чтобы большие документы не занимали часы при 500 dpi
+    @staticmethod
+    def run_case(path, render_params, render_limit, folder_name):
+        timings = dict.fromkeys(BenchmarkRunner.STAGES, 0.0)
+        _, ext = os.path.splitext(path)
+
+        start = time.perf_counter()
+        sheet_names = [None]
+        if ext != '.csv':
+            with pd.ExcelFile(path, engine='openpyxl') as xlsx:
+                sheet_names = [name for name in xlsx.sheet_names if 'Рис' in name]
+        timings['discovery'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sheets = app.FileUtils.load_sheets(path)
+        timings['load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        valid_sheets = app.DataProcessor.load_valid_sheets(sheets)
+        timings['validation'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for sheet in valid_sheets:
+            app.DiagramConstructor.filter_regions(sheets[sheet])
+        timings['filter_regions'] = time.perf_counter() - start
+
+        rendered = valid_sheets[:render_limit]
+        for sheet in rendered:
+            start = time.perf_counter()
+            fig = app.DiagramConstructor.build_figure(
+                sheets[sheet], render_params['standard_deviation'], render_params['show_original_values'],
+                render_params['orientation'], render_params['width'], render_params['height'], render_params['dpi'])
+            timings['figure'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            app.DiagramConstructor.save_figure(fig, sheet, folder_name, render_params['formats'],
+                                               render_params['dpi'])
+            timings['savefig'] += time.perf_counter() - start
+
+        return {
+            'timings': timings,
+            'discovered_sheets': len(sheet_names),
+            'valid_sheets': len(valid_sheets),
+            'rendered_sheets': len(rendered),
+            'peak_rss_kb': BenchmarkRunner.peak_rss_kb(),
+        }
+
+    # Прогон одного документа в новом процессе (spawn), чтобы пиковая память не включала предыдущие прогоны.
+    # matplotlib загружается в процессе заранее, чтобы его импорт не попадал в замер первой диаграммы
+    @staticmethod
+    def run_isolated(path, render_params, render_limit, folder_name):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return executor.submit(BenchmarkRunner.run_in_process, path, render_params, render_limit,
+                                   folder_name).result()
+
+    @staticmethod
+    def run_in_process(path, render_params, render_limit, folder_name):
+        app.DiagramConstructor.import_matplotlib()
+        return BenchmarkRunner.run_case(path, render_params, render_limit, folder_name)
+
+    # Прогон всех комбинаций параметров генератора
+    @staticmethod
+    def run_matrix(sheet_counts, region_counts, outlier_densities, file_formats, render_params, render_limit, repeat):
+        cases = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for sheets, regions, outliers, fmt in itertools.product(sheet_counts, region_counts,
+                                                                     outlier_densities, file_formats):
+                if fmt == 'csv' and sheets != sheet_counts[0]:
+                    # В CSV файле только один лист, остальные значения числа листов не отличаются
+                    continue
+                case_id = f'{fmt}-s{sheets}-r{regions}-o{outliers}'
+                path = os.path.join(tmp_dir, f'{case_id}.{fmt}')
+                WorkbookGenerator.generate(path, sheets, regions, outliers)
+                folder_name = os.path.join(tmp_dir, case_id)
+                os.makedirs(folder_name)
+
+                # Лучшее время из нескольких повторов для каждого этапа
+                runs = [BenchmarkRunner.run_isolated(path, render_params, render_limit, folder_name)
+                        for _ in range(repeat)]
+                timings = {stage: min(run['timings'][stage] for run in runs) for stage in BenchmarkRunner.STAGES}
+                timings['total'] = sum(timings.values())
+                case = {
+                    'id': case_id,
+                    'format': fmt,
+                    'sheets': sheets if fmt != 'csv' else 1,
+                    'regions': regions,
+                    'outlier_density': outliers,
+                    'discovered_sheets': runs[-1]['discovered_sheets'],
+                    'valid_sheets': runs[-1]['valid_sheets'],
+                    'rendered_sheets': runs[-1]['rendered_sheets'],
+                    'timings': timings,
+                    'peak_rss_kb': BenchmarkRunner.min_peak_rss_kb(runs),
+                }
+                print(f"{case_id}: " + ', '.join(f'{stage}={value:.3f}s' for stage, value in timings.items())
+                      + f", peak_rss={case['peak_rss_kb']}KB")
+                cases.append(case)
+        return cases
+
+    # Наименьшая пиковая память из нескольких повторов (None, если память не замерялась)
+    @staticmethod
+    def min_peak_rss_kb(runs):
+        peaks = [run['peak_rss_kb'] for run in runs if run['peak_rss_kb'] is not None]
+        return min(peaks) if peaks else None
+
+    # Сравнение с результатами предыдущего прогона: отношение времени этапов и пиковой памяти
+    # текущего прогона к базовому, для памяти используется отдельный допуск
+    @staticmethod
+    def compare(results, baseline, tolerance, memory_tolerance):
+        baseline_cases = {case['id']: case for case in baseline['cases']}
+        regressions = []
+        for case in results['cases']:
+            base = baseline_cases.get(case['id'])
+            if base is None:
+                continue
+            for stage, value in case['timings'].items():
+                base_value = base['timings'].get(stage)
+                if not base_value:
+                    continue
+                ratio = value / base_value
+                if ratio > 1 + tolerance:
+                    regressions.append(f"{case['id']} {stage}: {base_value:.3f}s -> {value:.3f}s (x{ratio:.2f})")
+            peak, base_peak = case.get('peak_rss_kb'), base.get('peak_rss_kb')
+            if peak and base_peak and peak / base_peak > 1 + memory_tolerance:
+                regressions.append(f"{case['id']} peak_rss: {base_peak}KB -> {peak}KB (x{peak / base_peak:.2f})")
+        return regressions
+
+
+def parse_list(value, cast):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер производительности parserDiagramsV2 на синтетических данных")
+    parser.add_argument('--sheets', default='1,20', help="Количество листов через запятую (1-200)")
+    parser.add_argument('--regions', default='10,500', help="Количество регионов через запятую (10-5000)")
+    parser.add_argument('--outliers', default='0,0.05', help="Доли выбросов через запятую")
+    parser.add_argument('--formats', default='xlsx,csv', help="Форматы документов: xlsx, csv")
+    parser.add_argument('--render-limit', type=int, default=3, help="Максимум строящихся диаграмм на документ")
+    parser.add_argument('--dpi', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=1, help="Количество повторов каждого прогона")
+    parser.add_argument('--output', default='benchmark_results.json', help="Файл результатов")
+    parser.add_argument('--baseline', help="Файл результатов предыдущего прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Допустимое замедление (0.1 = 10%%)")
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+                        help="Допустимое увеличение пиковой памяти (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    render_params = {'standard_deviation': 4, 'show_original_values': True, 'orientation': False,
+                     'width': 8, 'height': 11, 'formats': ['png'], 'dpi': args.dpi}
+    cases = BenchmarkRunner.run_matrix(parse_list(args.sheets, int), parse_list(args.regions, int),
+                                       parse_list(args.outliers, float), parse_list(args.formats, str),
+                                       render_params, args.render_limit, args.repeat)
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'matplotlib': matplotlib.__version__,
+            'numpy': np.__version__,
+        },
+        'render_params': render_params,
+        'render_limit': args.render_limit,
+        'cases': cases,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = BenchmarkRunner.compare(results, baseline, args.tolerance, args.memory_tolerance)
+        if regressions:
+            print("Замедление или рост памяти относительно базового прогона:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Замедлений и роста памяти относительно базового прогона нет.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
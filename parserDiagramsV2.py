@@ -1,31 +1,257 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.ticker import ScalarFormatter
-import matplotlib.ticker as ticker
+import time
+
+# Время начала загрузки программы (для вывода времени запуска в режимах --list-sheets и --validate)
+STARTED = time.perf_counter()
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import argparse
+import contextlib
+import cProfile
+import csv
+import hashlib
+import importlib
+import io
+import json
 import os
 import logging
+import mimetypes
+import queue
+import shutil
 import sys
+import tempfile
+import threading
+import urllib.parse
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    # Модуль resource недоступен на Windows, там пиковая память читается через WinAPI
+    resource = None
+
+
+# Отложенный импорт модуля: модуль загружается при первом обращении к его атрибуту
+# и после этого заменяет собой объект в глобальных переменных программы
+class LazyModule:
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return getattr(module, attribute)
+
+
+# numpy и pandas загружаются при первом обращении, поэтому режимы --list-sheets и --validate,
+# а также вывод справки не тратят время на их импорт
+np = LazyModule('numpy', 'np')
+pd = LazyModule('pandas', 'pd')
+
+# matplotlib загружается только перед построением диаграмм (см. DiagramConstructor.import_matplotlib),
+# режим --stats-only обходится без него
+plt = None
+PolyCollection = None
+PdfPages = None
+ScalarFormatter = None
+ticker = None
 
 
 # Набор функций, отвечающие за чтение и анализ данных из файлов
 class FileUtils:
+    # Колонки A, C, D и E - колонки по умолчанию, которые используются при построении диаграмм
+    USED_COLUMNS = [0, 2, 3, 4]
+
+    CSV_CHUNK_SIZE = 100000  # Количество строк CSV файла, читаемых за один раз
+    CSV_COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zip': 'zip'}
+
+    # Колонки для чтения по параметру columns: 'C:E', 'C,D,E,F', имена колонок из строки заголовка
+    # ('C,2024,2023') или 'auto' (все колонки, столбцы с годами определяются по строке годов).
+    # Колонка A с регионами читается всегда. Имена колонок заменяются номерами в resolve_columns
+    @staticmethod
+    def parse_columns(spec):
+        if spec is None:
+            return FileUtils.USED_COLUMNS
+        if spec.strip().lower() == 'auto':
+            return None
+        positions, names = [], []
+        for part in spec.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            first, _, last = part.upper().replace(' ', '').partition(':')
+            if not FileUtils.is_column_letters(first) or (last and not FileUtils.is_column_letters(last)):
+                names.append(part)
+                continue
+            start = FileUtils.column_position(first)
+            end = FileUtils.column_position(last) if last else start
+            positions.extend(range(start, end + 1))
+        return sorted({0, *positions}) + names
+
+    # Проверка буквенного обозначения колонки (A, BC, XFD)
+    @staticmethod
+    def is_column_letters(letters):
+        return 0 < len(letters) <= 3 and letters.isascii() and letters.isalpha()
+
+    # Замена имен колонок номерами по строке заголовка таблицы
+    @staticmethod
+    def resolve_columns(usecols, header):
+        if usecols is None or all(isinstance(column, int) for column in usecols):
+            return usecols
+        header = [str(name) for name in header]
+        positions = set()
+        for column in usecols:
+            if isinstance(column, int):
+                positions.add(column)
+            elif column in header:
+                positions.add(header.index(column))
+            else:
+                raise ValueError(f"Колонка '{column}' не найдена.")
+        return sorted(positions)
+
+    # Номер колонки по ее буквенному обозначению (A - 0, B - 1, ..., AA - 26)
+    @staticmethod
+    def column_position(letters):
+        if not letters.isalpha():
+            raise ValueError(f"Неверное обозначение колонки '{letters}'.")
+        position = 0
+        for letter in letters:
+            position = position * 26 + ord(letter) - ord('A') + 1
+        return position - 1
+
+    # Расширение файла с учетом сжатия CSV (report.csv.gz - .csv.gz)
+    @staticmethod
+    def file_extension(file_path):
+        name, ext = os.path.splitext(file_path)
+        if ext in FileUtils.CSV_COMPRESSIONS:
+            ext = os.path.splitext(name)[1] + ext
+        return ext
+
+    # Имя файла без расширения
+    @staticmethod
+    def file_stem(file_path):
+        name = os.path.basename(file_path)
+        return name[:len(name) - len(FileUtils.file_extension(name))]
+
+    # Буквенное обозначение колонки по ее номеру (0 - A, 26 - AA)
+    @staticmethod
+    def column_letters(position):
+        letters = ''
+        position += 1
+        while position:
+            position, remainder = divmod(position - 1, 26)
+            letters = chr(ord('A') + remainder) + letters
+        return letters
+
     # Функция проверки файл на то, что он табличного типа
     @staticmethod
     def is_valid_file(file_path):
-        valid_extensions = ['.xlsx', '.xls', '.csv']
-        _, ext = os.path.splitext(file_path)
-        return ext in valid_extensions
+        valid_extensions = ['.xlsx', '.xls', '.csv'] + [f'.csv{ext}' for ext in FileUtils.CSV_COMPRESSIONS]
+        return FileUtils.file_extension(file_path) in valid_extensions
 
-    # Функция загрузки данных из табличного документа
+    # Потоковое чтение CSV файла: читаются только нужные колонки, файл читается частями по chunk_size строк,
+    # а значения колонок с годами приводятся к float. Строки регионов, которые не попадут в диаграмму
+    # (см. DiagramConstructor.region_filter), отбрасываются в каждой части, поэтому в памяти одновременно находятся
+    # одна часть файла и отобранные регионы. Первые две строки таблицы (название и строка годов) берутся из той же
+    # последовательности строк, что и при обычном чтении pd.read_csv, поэтому пустые строки пропускаются одинаково.
+    # Несжатый файл на диске отображается в память (memory_map), сжатый (.csv.gz и др.) распаковывается по ходу чтения
     @staticmethod
-    def load_data(file_path, sheet_name=None):
-        _, ext = os.path.splitext(file_path)
+    def read_csv(source, usecols=USED_COLUMNS, ext='.csv', chunk_size=CSV_CHUNK_SIZE):
+        compression = FileUtils.CSV_COMPRESSIONS.get(ext[len('.csv'):])
+        memory_map = compression is None and isinstance(source, (str, os.PathLike))
+        options = {'compression': compression, 'memory_map': memory_map}
+        if usecols is not None and not all(isinstance(column, int) for column in usecols):
+            usecols = FileUtils.resolve_columns(usecols, pd.read_csv(source, nrows=0, **options).columns)
+            FileUtils.rewind(source)
+        head = None
+        year_columns = None
+        parts = []
+        with pd.read_csv(source, usecols=usecols, chunksize=chunk_size, **options) as reader:
+            for chunk in reader:
+                if year_columns is None:
+                    # Строка с названием и строка годов могут оказаться в разных частях при малом chunk_size
+                    taken = 2 - (0 if head is None else len(head))
+                    head = chunk.iloc[:taken] if head is None else pd.concat([head, chunk.iloc[:taken]])
+                    chunk = chunk.iloc[taken:]
+                    if len(head) < 2:
+                        continue
+                    year_columns = DataProcessor.locate_year_columns(head)
+                    if not year_columns:
+                        return head
+                    parts.append(head)
+                # Колонки части совпадают с колонками head, года идут от раннего к позднему, как в filter_regions
+                chunk = chunk.astype({chunk.columns[j]: float for j in year_columns})
+                parts.append(chunk[DiagramConstructor.region_filter(chunk.iloc[:, year_columns].values)])
+        if year_columns is None:
+            return head
+        return pd.concat(parts, ignore_index=True)
+
+    # Возврат файлового объекта в начало для повторного чтения
+    @staticmethod
+    def rewind(source):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+    # Функция однократной загрузки всех листов "Рис" табличного документа (только колонки A, C, D и E).
+    # Книга открывается один раз в режиме только для чтения, каждый лист читается один раз,
+    # а полученные таблицы используются и при проверке листов, и при построении диаграмм.
+    # Кроме пути принимает содержимое документа (bytes или файловый объект), формат которого задается file_format
+    @staticmethod
+    def load_sheets(file_path, usecols=USED_COLUMNS, file_format=None, chunk_size=CSV_CHUNK_SIZE):
+        if isinstance(file_path, (bytes, bytearray)):
+            file_path = io.BytesIO(file_path)
+        if file_format is not None:
+            ext = '.' + file_format.lstrip('.').lower()
+        elif isinstance(file_path, (str, os.PathLike)):
+            ext = FileUtils.file_extension(os.fspath(file_path))
+        else:
+            ext = '.xlsx'
         if ext == '.xlsx' or ext == '.xls':
-            return pd.read_excel(file_path, sheet_name=sheet_name, engine='openpyxl')
-        elif ext == '.csv':
-            return pd.read_csv(file_path)
+            sheets = {}
+            with pd.ExcelFile(file_path, engine='openpyxl') as xlsx:
+                sheet_names = [name for name in xlsx.sheet_names if 'Рис' in name]
+                for sheet_name in sheet_names:
+                    try:
+                        with Instrumentation.stage('load', sheet_name):
+                            sheet_columns = usecols
+                            if usecols is not None and not all(isinstance(column, int) for column in usecols):
+                                header = xlsx.parse(sheet_name, nrows=0).columns
+                                sheet_columns = FileUtils.resolve_columns(usecols, header)
+                            sheets[sheet_name] = xlsx.parse(sheet_name, usecols=sheet_columns)
+                    except Exception as e:
+                        logging.error(f"Ошибка при обработке листа '{sheet_name}': {str(e)}")
+                        print(f"Ошибка при обработке листа '{sheet_name}': {e}")
+                        Instrumentation.record_error('load', sheet_name, e)
+            return sheets
         else:
-            raise ValueError(f"Формат файла {ext} не поддерживается.")
+            # В случае CSV файла нет листов
+            try:
+                with Instrumentation.stage('load'):
+                    return {None: FileUtils.read_csv(file_path, usecols, ext, chunk_size)}
+            except Exception as e:
+                logging.error(f"Ошибка при чтении CSV файла: {str(e)}")
+                print(f"Ошибка при чтении CSV файла: {e}")
+                Instrumentation.record_error('load', None, e)
+                return {}
+
+    # Выбор колонок из уже загруженной таблицы (для таблиц, переданных через DiagramAPI)
+    @staticmethod
+    def select_columns(df, usecols=USED_COLUMNS):
+        if usecols is None:
+            return df
+        usecols = FileUtils.resolve_columns(usecols, df.columns)
+        return df.iloc[:, [position for position in usecols if position < df.shape[1]]]
+
+    # Запись сохраненных в памяти диаграмм в файлы папки
+    @staticmethod
+    def write_images(folder_name, sheet_name, images):
+        for fmt, data in images.items():
+            with open(f'{folder_name}/{sheet_name}.{fmt}', 'wb') as file:
+                file.write(data)
 
     # Функция создания папки для сохранения png картинок сгенерированных диаграмм
     @staticmethod
@@ -38,6 +264,14 @@ class FileUtils:
         os.makedirs(folder_name)
         return folder_name
 
+    # Функция создания постоянной папки для инкрементального режима: папка зависит только от имени документа,
+    # поэтому при повторных запусках уже построенные диаграммы переиспользуются
+    @staticmethod
+    def create_stable_folder(file_path, base_folder='Graphics'):
+        folder_name = f"{base_folder}_{FileUtils.file_stem(file_path)}"
+        os.makedirs(folder_name, exist_ok=True)
+        return folder_name
+
     # Функция отвечающая за создание error.log файлов
     @staticmethod
     def create_unique_log_file(base_log_file='errors.log'):
@@ -51,241 +285,475 @@ class FileUtils:
 
 # Набор функций, отвечающие за сбор данных
 class DataProcessor:
-    # Сбор читаемых листов из табличного документа
+    # Сбор читаемых листов из уже загруженных листов табличного документа (см. FileUtils.load_sheets)
     @staticmethod
-    def load_valid_sheets(file_path):
-        _, ext = os.path.splitext(file_path)
-        if ext == '.xlsx' or ext == '.xls':
-            xlsx = pd.ExcelFile(file_path)
-            sheet_names = [name for name in xlsx.sheet_names if 'Рис' in name]
-            valid_sheets = []
+    def load_valid_sheets(sheets):
+        valid_sheets = []
+        for sheet_name, df in sheets.items():
+            if sheet_name is None:
+                # В случае CSV файла нет листов
+                valid_sheets.append(sheet_name)
+                continue
+            try:
+                with Instrumentation.stage('validation', sheet_name):
+                    year_columns = DataProcessor.locate_year_columns(df)
+                    if not year_columns:
+                        raise ValueError("Не найдены колонки с годами")
+                    df.iloc[2:, year_columns].astype(float)
+                valid_sheets.append(sheet_name)
+            except Exception as e:
+                logging.error(f"Ошибка при обработке листа '{sheet_name}': {str(e)}")
+                print(f"Ошибка при обработке листа '{sheet_name}': {e}")
+                Instrumentation.record_error('validation', sheet_name, e)
+                continue
+        return valid_sheets
 
-            for sheet_name in sheet_names:
-                try:
-                    df = FileUtils.load_data(file_path, sheet_name)
-                    df.iloc[2:, 2].astype(float)
-                    df.iloc[2:, 3].astype(float)
-                    df.iloc[2:, 4].astype(float)
-                    valid_sheets.append(sheet_name)
-                except Exception as e:
-                    logging.error(f"Ошибка при обработке листа '{sheet_name}': {str(e)}")
-                    print(f"Ошибка при обработке листа '{sheet_name}': {e}")
-                    continue
-            return valid_sheets
-        else:
-            # В случае CSV файла нет листов
-            return [None]
+    # Проверка значения строки годов: целое число от 1900 до 2100
+    @staticmethod
+    def is_year(value):
+        try:
+            year = float(value)
+        except (TypeError, ValueError):
+            return False
+        return year.is_integer() and 1900 <= year <= 2100
+
+    # Поиск колонок с годами по строке годов (вторая строка таблицы). Колонка A с регионами не учитывается.
+    # Колонки упорядочиваются по возрастанию года независимо от их расположения на листе, поэтому
+    # самый поздний год всегда становится последним рядом диаграммы
+    @staticmethod
+    def locate_year_columns(df):
+        if len(df) < 2:
+            return []
+        header = df.iloc[1]
+        return DataProcessor.order_year_columns([header.iloc[j] for j in range(df.shape[1])])
+
+    # Номера ячеек строки годов, содержащих год, по возрастанию года (ячейка 0 - колонка регионов).
+    # При одинаковых годах колонки идут справа налево, как в исходных листах (C - 2024, D - 2023, E - 2022)
+    @staticmethod
+    def order_year_columns(cells):
+        columns = [j for j in range(len(cells) - 1, 0, -1) if DataProcessor.is_year(cells[j])]
+        return sorted(columns, key=lambda j: float(cells[j]))
 
     # Чтение двух параметров из файла parameters.txt
     @staticmethod
     def read_parameters_from_file(file_path):
-        params = {}
         with open(file_path, 'r') as file:
-            for line in file:
-                key, value = line.strip().split('=')
-                if key == "standard_deviation":
-                    params[key] = float(value)
-                elif key == "show_original_values":
-                    params[key] = value.lower() == 'true'
-                elif key == "orientation":
-                    params[key] = value.lower() == 'true'
-                elif key == "width":
-                    params[key] = float(value)
-                elif key == 'height':
-                    params[key] = float(value)
-                elif key == 'number':
-                    params[key] = int(value)
+            pairs = [line.strip().split('=') for line in file]
+        return DataProcessor.parse_parameters(pairs)
+
+    # Приведение значений параметров к нужным типам (для parameters.txt и для запросов к сервису)
+    @staticmethod
+    def parse_parameters(pairs):
+        params = {}
+        for key, value in pairs:
+            if key == "standard_deviation":
+                params[key] = float(value)
+            elif key == "show_original_values":
+                params[key] = value.lower() == 'true'
+            elif key == "orientation":
+                params[key] = value.lower() == 'true'
+            elif key == "width":
+                params[key] = float(value)
+            elif key == 'height':
+                params[key] = float(value)
+            elif key == 'number':
+                params[key] = int(value)
+            elif key == 'workers':
+                params[key] = int(value)
+            elif key == 'incremental':
+                params[key] = value.lower() == 'true'
+            elif key == 'profile':
+                params[key] = value.lower()
+            elif key == 'formats':
+                params[key] = [fmt.strip().lower() for fmt in value.split(',') if fmt.strip()]
+            elif key == 'dpi':
+                params[key] = int(value)
+            elif key == 'report':
+                params[key] = value.lower() == 'true'
+            elif key == 'cprofile':
+                params[key] = value.lower() == 'true'
+            elif key == 'columns':
+                params[key] = value
+            elif key == 'chunk_size':
+                params[key] = int(value)
+            elif key == 'memory_budget':
+                params[key] = float(value)
         return params
 
 
-# Набор функций отвечающих за генерацию диаграмм
-class DiagramConstructor:
-    # Нахождение значений превышающих стандартное отклонение и их сокращение
-    @staticmethod
-    def bar_adjust(value, threshold, max_non_outlier_value):
-        adjusted_height = value
-        white_cut = False
-        if value > threshold:
-            if value > max_non_outlier_value:
-                adjusted_height = max_non_outlier_value
-                white_cut = True
-        return adjusted_height, white_cut
-
-    # Добавление "белых срезов" для сокращенных столбцов
-    @staticmethod
-    def add_white_section(bars, original_values, adjusted_values, orientation):
-        for bar, original, (adjusted, white_cut) in zip(bars, original_values, adjusted_values):
-            if white_cut:
-                if orientation:
-                    white_height = bar.get_height() * 0.02
-                    x = bar.get_x() + bar.get_width() / 2
-                    y = bar.get_height() - bar.get_height() * 0.05
-                    plt.bar(x, white_height, bottom=y, width=bar.get_width(), color='white', edgecolor='none')
-                else:
-                    white_width = bar.get_width() * 0.02
-                    y = bar.get_y() + bar.get_height() / 2
-                    x = bar.get_width() - bar.get_width() * 0.05
-                    plt.barh(y, white_width, left=x, height=bar.get_height(), color='white', edgecolor='none')
+# Быстрая проверка документа без pandas и matplotlib: книга читается openpyxl в режиме только для чтения
+# построчно, CSV файл - модулем csv. Проверяются названия листов, строка годов и числовые значения
+# в колонках с годами по тем же правилам, что и при загрузке (DataProcessor.load_valid_sheets)
+class WorkbookInspector:
+    # Проверка всех листов "Рис" документа. validate=False - только названия листов и строка годов
+    @staticmethod
+    def inspect(file_path, usecols=FileUtils.USED_COLUMNS, validate=True):
+        ext = FileUtils.file_extension(file_path)
+        if ext == '.xlsx' or ext == '.xls':
+            import openpyxl
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                return [WorkbookInspector.inspect_rows(name, WorkbookInspector.sheet_rows(workbook[name]), usecols,
+                                                       validate)
+                        for name in workbook.sheetnames if 'Рис' in name]
+            finally:
+                workbook.close()
+        with WorkbookInspector.open_csv(file_path, ext) as file:
+            # Как и pandas, пропускаются только физически пустые строки; строка ",,,," читается как строка
+            # пустых значений
+            rows = ((row_number, tuple(WorkbookInspector.csv_value(value) for value in row))
+                    for row_number, row in enumerate(csv.reader(file), start=1) if row)
+            return [WorkbookInspector.inspect_rows(None, rows, usecols, validate)]
 
-    # Функция чтения регионов и выборки в соответствии с условиями
+    # Строки листа книги с их номерами так, как их читает pandas: пустые строки внутри листа сохраняются
+    # (в таблице это строки пустых значений), а пустые строки в конце листа не читаются
     @staticmethod
-    def filter_regions(df):
-        # Чтение регионов из колонки A с 4 строки
-        regions = df.iloc[2:, 0].values
-        # Чтение числовых значений из колонок E, D и C с 4 строки (это 2022, 2023 и 2024)
-        values_1 = df.iloc[2:, 4].astype(float).values
-        values_2 = df.iloc[2:, 3].astype(float).values
-        values_3 = df.iloc[2:, 2].astype(float).values
+    def sheet_rows(worksheet):
+        # Размеры листа, записанные в файле, могут быть неверными, поэтому, как и в pandas, они вычисляются заново
+        worksheet.reset_dimensions()
+        blank_rows = []
+        for row_number, row in enumerate(worksheet.iter_rows(values_only=True), start=1):
+            if all(cell is None for cell in row):
+                blank_rows.append((row_number, row))
+                continue
+            yield from blank_rows
+            blank_rows = []
+            yield row_number, row
 
-        # Года из третьей строки (индекс 2) и соответствующих столбцов
-        year_1 = df.iloc[1, 4]  # Год в колонке E (2022)
-        year_2 = df.iloc[1, 3]  # Год в колонке D (2023)
-        year_3 = df.iloc[1, 2]  # Год в колонке C (2024)
+    # Открытие CSV файла, в том числе сжатого
+    @staticmethod
+    def open_csv(file_path, ext):
+        compression = FileUtils.CSV_COMPRESSIONS.get(ext[len('.csv'):])
+        if compression == 'gzip':
+            import gzip
+            return gzip.open(file_path, 'rt', encoding='utf-8', newline='')
+        if compression == 'bz2':
+            import bz2
+            return bz2.open(file_path, 'rt', encoding='utf-8', newline='')
+        if compression == 'xz':
+            import lzma
+            return lzma.open(file_path, 'rt', encoding='utf-8', newline='')
+        if compression == 'zip':
+            import zipfile
+            archive = zipfile.ZipFile(file_path)
+            return io.TextIOWrapper(archive.open(archive.namelist()[0]), encoding='utf-8', newline='')
+        return open(file_path, 'r', encoding='utf-8', newline='')
 
-        # Условие для фильтрации: региона, у которого нет данных за 3 года, исключаются
-        non_zero_filter = (values_1 != 0) | (values_2 != 0) | (values_3 != 0)  # Регион имеет данные хотя бы за один год
+    # Пустая ячейка CSV файла соответствует пустой ячейке книги
+    @staticmethod
+    def csv_value(value):
+        return value if value != '' else None
 
-        # Условия для исключения:
-        # 1. Регионы без данных за 3 года.
-        # 2. Регионы без данных за 2 года, но с данными за третий год.
-        valid_filter = non_zero_filter & ((values_1 != 0).astype(int) + (values_2 != 0).astype(int) +
-                                          (values_3 != 0).astype(int) >= 2) | (values_3 != 0)
+    # Проверка строк одного листа. rows - пары (номер строки, значения) строк, которые читает pandas
+    # (см. sheet_rows): первая строка - заголовок, третья - строка годов, далее строки регионов
+    @staticmethod
+    def inspect_rows(sheet_name, rows, usecols, validate):
+        result = {'sheet': sheet_name, 'valid': False, 'years': [], 'regions': 0, 'plotted_regions': 0,
+                  'error': None}
+        year_columns = None
+        table_row = 0  # Номер строки таблицы: 1 - заголовок, 2 - название, 3 - года, далее регионы
+        for row_number, row in rows:
+            if usecols is not None and not all(isinstance(column, int) for column in usecols):
+                # Имена колонок из параметра columns ищутся в первой строке (заголовке)
+                try:
+                    usecols = FileUtils.resolve_columns(usecols, row)
+                except ValueError as e:
+                    result['error'] = str(e)
+                    return result
+            if usecols is None:
+                cells = list(row)
+            else:
+                cells = [row[j] if j < len(row) else None for j in usecols]
+            table_row += 1
+            if table_row <= 2:
+                continue
+            if year_columns is None:
+                # Колонки по возрастанию года, как в DataProcessor.locate_year_columns
+                year_columns = DataProcessor.order_year_columns(cells)
+                result['years'] = [int(float(cells[k])) for k in year_columns]
+                if not year_columns or not validate:
+                    break
+                continue
+            result['regions'] += 1
+            values = []
+            for k in year_columns:
+                try:
+                    values.append(float(cells[k]) if cells[k] is not None else float('nan'))
+                except (TypeError, ValueError):
+                    letters = FileUtils.column_letters(usecols[k] if usecols is not None else k)
+                    result['error'] = f"Нечисловое значение в ячейке {letters}{row_number}: '{cells[k]}'"
+                    return result
+            # То же условие, что в DiagramConstructor.region_filter (пустая ячейка считается ненулевой)
+            non_zero = [value != 0 for value in values]
+            if sum(non_zero) >= 2 or non_zero[-1]:
+                result['plotted_regions'] += 1
+        if not year_columns:
+            result['error'] = "Не найдены колонки с годами"
+            return result
+        result['valid'] = True
+        return result
 
-        regions, values_1, values_2, values_3 = [arr[valid_filter] for arr in
-                                                 [regions, values_1, values_2, values_3]]
 
-        # Сортировка регионов по возрастанию относительно колонки C
-        sorted_indices = values_3.argsort()
-        regions, values_1, values_2, values_3 = [arr[sorted_indices] for arr in
-                                                 [regions, values_1, values_2, values_3]]
+# Расчет статистики сразу для всех рядов (годов): значения хранятся в одной матрице регионы x годы
+class SeriesStatistics:
+    # Средние и стандартные отклонения по положительным значениям, пороги выбросов,
+    # максимальное значение ниже порога, высоты столбцов и маска сокращенных столбцов
+    @staticmethod
+    def compute(values, standard_deviation):
+        positive = values > 0
+        counts = positive.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(positive, values, 0).sum(axis=0) / counts
+            stds = np.sqrt(np.where(positive, (values - means) ** 2, 0).sum(axis=0) / counts)
+        thresholds = means + standard_deviation * stds
+
+        # Максимальное значение, не преодолевшее порог выброса
+        below_threshold = values <= thresholds
+        if not below_threshold.any(axis=0).all():
+            raise ValueError("Нет значений ниже порога выбросов")
+        max_non_outlier_value = np.where(below_threshold, values, -np.inf).max()
 
-        return regions, values_1, values_2, values_3, year_1, year_2, year_3
+        adjusted, white_cuts = DiagramConstructor.bar_adjust(values, thresholds, max_non_outlier_value)
+        return {
+            'means': means,
+            'stds': stds,
+            'thresholds': thresholds,
+            'max_non_outlier_value': max_non_outlier_value,
+            'adjusted': adjusted,
+            'white_cuts': white_cuts,
+        }
 
-    # Базовая функция генерации диаграмм
+    # Таблица статистики одного листа без построения диаграммы: строка на каждую пару регион/год
+    # (row_type='region') и строка итогов на каждый год (row_type='summary')
     @staticmethod
-    def make_diagrams(sheet_name, file_path, folder_name, standard_deviation, show_original_values, orientation, my_width, my_height):
-        df = FileUtils.load_data(file_path, sheet_name=sheet_name)
+    def sheet_table(sheet_name, df, standard_deviation):
+        regions, values, years = DiagramConstructor.filter_regions(df)
+        stats = SeriesStatistics.compute(values, standard_deviation)
+        return SeriesStatistics.tables(sheet_name, regions, values, years, stats)
 
-        regions, values_1, values_2, values_3, year_1, year_2, year_3 = DiagramConstructor.filter_regions(df)
+    # Таблицы статистики по уже рассчитанной статистике листа
+    @staticmethod
+    def tables(sheet_name, regions, values, years, stats):
+        region_count, series_count = values.shape
+        years = np.array([int(year) for year in years])
 
-        # фильтр регионов, которые мы принимаем при расчетах
-        valid_data_filter = (((values_1 != 0).astype(int) +
-                             (values_2 != 0).astype(int) +
-                             (values_3 != 0).astype(int) >= 2) |  # Учитываем регионы с данными за 2 или 3 года
-                             (values_3 != 0))  # Учитываем регионы с данными только за третий год
+        region_rows = pd.DataFrame({
+            'sheet': sheet_name,
+            'row_type': 'region',
+            'region': np.repeat(regions, series_count),
+            'rank': np.repeat(np.arange(region_count), series_count),
+            'year': np.tile(years, region_count),
+            'value': values.ravel(),
+            'adjusted_value': stats['adjusted'].ravel(),
+            'clipped': stats['white_cuts'].ravel(),
+            'mean': np.tile(stats['means'], region_count),
+            'std': np.tile(stats['stds'], region_count),
+            'threshold': np.tile(stats['thresholds'], region_count),
+        })
+        summary_rows = pd.DataFrame({
+            'sheet': sheet_name,
+            'row_type': 'summary',
+            'year': years,
+            'mean': stats['means'],
+            'std': stats['stds'],
+            'threshold': stats['thresholds'],
+            'max_non_outlier_value': stats['max_non_outlier_value'],
+            'regions': region_count,
+            'clipped_count': stats['white_cuts'].sum(axis=0),
+        })
+        return region_rows, summary_rows
 
-        mean_1, mean_2, mean_3 = [arr[valid_data_filter & (arr > 0)].mean() for arr in
-                                  [values_1, values_2, values_3]]  # Средние значения по фильтрации
-        std_2022, std_2023, std_2024 = [arr[valid_data_filter & (arr > 0)].std(ddof=0) for arr in
-                                        [values_1, values_2, values_3]]  # Показатели стандартного отклонения
-        # по фильтрации
-        threshold_1, threshold_2, threshold_3 = [mean + standard_deviation * std for mean, std in
-                                                 zip([mean_1, mean_2, mean_3],
-                                                     [std_2022, std_2023, std_2024])]  # Пороги выбросов по фильтрации
 
-        x = range(len(regions))
-        width = 0.25
+# Набор функций отвечающих за генерацию диаграмм
+class DiagramConstructor:
+    # Цвета рядов: для трех рядов - исходные цвета (серый, оранжевый, синий), для большего числа - палитра
+    BASE_COLORS = ['#A5A5A5', '#ED7D31', '#5B9BD5']
+    PALETTE = ['#A5A5A5', '#ED7D31', '#5B9BD5', '#FFC000', '#4472C4', '#70AD47', '#264478', '#9E480E',
+               '#636363', '#997300']
+    # Общая ширина группы столбцов одного региона
+    GROUP_WIDTH = 0.75
+    # Фигура текущего процесса, используемая для всех листов, и ее размер (ширина, высота, dpi)
+    figure = None
+    figure_key = None
 
-        plt.figure(figsize=(my_width, my_height), dpi=500)
+    # Загрузка matplotlib при первом построении диаграммы в текущем процессе
+    @staticmethod
+    def import_matplotlib():
+        global plt, PolyCollection, PdfPages, ScalarFormatter, ticker
+        if plt is not None:
+            return
+        import matplotlib
+        # Неинтерактивный бэкенд: диаграммы только сохраняются в файлы, в том числе из параллельных процессов
+        matplotlib.use('Agg')
+        import matplotlib.pyplot
+        import matplotlib.ticker
+        from matplotlib.collections import PolyCollection as poly_collection
+        from matplotlib.backends.backend_pdf import PdfPages as pdf_pages
+        PolyCollection, PdfPages = poly_collection, pdf_pages
+        ScalarFormatter, ticker = matplotlib.ticker.ScalarFormatter, matplotlib.ticker
+        plt = matplotlib.pyplot
 
-        # Максимальное значение, не преодолевшее порог выброса
-        max_non_outlier_value = max(
-            max(values_1[values_1 <= threshold_1]),
-            max(values_2[values_2 <= threshold_2]),
-            max(values_3[values_3 <= threshold_3])
-        )
-        # Генерация диаграммы
-        adjusted_1 = [DiagramConstructor.bar_adjust(v, threshold_1, max_non_outlier_value) for v in values_1]
-        adjusted_2 = [DiagramConstructor.bar_adjust(v, threshold_2, max_non_outlier_value) for v in values_2]
-        adjusted_3 = [DiagramConstructor.bar_adjust(v, threshold_3, max_non_outlier_value) for v in values_3]
+    # Профили сохранения диаграмм: форматы файлов и разрешение растровых форматов.
+    # Формат 'book' - единый многостраничный PDF со всеми диаграммами документа
+    RENDER_PROFILES = {
+        'final': {'formats': ['png'], 'dpi': 500},
+        'draft': {'formats': ['png'], 'dpi': 100},
+        'vector': {'formats': ['svg', 'pdf'], 'dpi': 500},
+        'book': {'formats': ['book'], 'dpi': 500},
+    }
+    SUPPORTED_FORMATS = ['png', 'svg', 'pdf', 'book']
+
+    # Нахождение значений превышающих стандартное отклонение и их сокращение.
+    # Работает сразу со всем массивом (или матрицей с порогом для каждого ряда):
+    # возвращает высоты столбцов и маску сокращенных столбцов
+    @staticmethod
+    def bar_adjust(values, threshold, max_non_outlier_value):
+        values = np.asarray(values, dtype=float)
+        white_cuts = (values > threshold) & (values > max_non_outlier_value)
+        adjusted_heights = np.where(white_cuts, max_non_outlier_value, values)
+        return adjusted_heights, white_cuts
 
+    # Добавление "белых срезов" для сокращенных столбцов одним набором прямоугольников на серию
+    @staticmethod
+    def add_white_section(ax, positions, adjusted_heights, white_cuts, bar_width, orientation):
+        if not white_cuts.any():
+            return None
+        centers = np.asarray(positions, dtype=float)[white_cuts]
+        heights = adjusted_heights[white_cuts]
+        # Срез толщиной 2% длины столбца на расстоянии 5% от его конца
+        start = heights - heights * 0.05
+        end = start + heights * 0.02
+        left = centers - bar_width / 2
+        right = centers + bar_width / 2
         if orientation:
-            # print('vertical')
-            bars_1 = plt.bar([i - width for i in x], [adj[0] for adj in adjusted_1], width=width,
-                             label=f'{str(int(year_1))} — {int(round(mean_1)):,}'.replace(',', ' '), color='#A5A5A5')
-            bars_2 = plt.bar(x, [adj[0] for adj in adjusted_2], width=width,
-                             label=f'{str(int(year_2))} — {int(round(mean_2)):,}'.replace(',', ' '), color='#ED7D31')
-            bars_3 = plt.bar([i + width for i in x], [adj[0] for adj in adjusted_3], width=width,
-                             label=f'{str(int(year_3))} — {int(round(mean_3)):,}'.replace(',', ' '), color='#5B9BD5')
+            corners = [(left, start), (left, end), (right, end), (right, start)]
         else:
-            # print('horizontal')
-            bars_1 = plt.barh([i - width for i in x], [adj[0] for adj in adjusted_1], height=width,
-                              label=f'{str(int(year_1))} — {int(round(mean_1)):,}'.replace(',', ' '), color='#A5A5A5')
-            bars_2 = plt.barh(x, [adj[0] for adj in adjusted_2], height=width,
-                              label=f'{str(int(year_2))} — {int(round(mean_2)):,}'.replace(',', ' '), color='#ED7D31')
-            bars_3 = plt.barh([i + width for i in x], [adj[0] for adj in adjusted_3], height=width,
-                              label=f'{str(int(year_3))} — {int(round(mean_3)):,}'.replace(',', ' '), color='#5B9BD5')
+            corners = [(start, left), (end, left), (end, right), (start, right)]
+        verts = np.stack([np.column_stack(corner) for corner in corners], axis=1)
+        collection = PolyCollection(verts, facecolors='white', edgecolors='none')
+        ax.add_collection(collection, autolim=False)
+        return collection
 
-        # Подрисовка белых обрезаний у сокращенных столбиков
-        DiagramConstructor.add_white_section(bars_1, values_1, adjusted_1, orientation)
-        DiagramConstructor.add_white_section(bars_2, values_2, adjusted_2, orientation)
-        DiagramConstructor.add_white_section(bars_3, values_3, adjusted_3, orientation)
+    # Подписи исходных значений столбцов: сокращенных или превышающих максимальную метрику оси
+    @staticmethod
+    def add_original_values(positions, values, adjusted_heights, white_cuts, max_metric, orientation, ha, va):
+        label_indices = np.flatnonzero(white_cuts | (values > max_metric))
+        for i in label_indices:
+            label = f'{int(values[i]):,}'.replace(',', ' ')
+            if orientation:
+                plt.text(positions[i], adjusted_heights[i] + 3.5, label, ha=ha, va='bottom', rotation=90, fontsize=5)
+            else:
+                plt.text(adjusted_heights[i] + 3.5, positions[i], label, ha='left', va=va, fontsize=5)
+
+    # Маска регионов, попадающих в диаграмму (values - регионы x годы, от раннего года к позднему).
+    # Условие проверяется для каждой строки отдельно, поэтому применяется и к частям таблицы при потоковом чтении.
+    # Условия для исключения:
+    # 1. Регионы без данных хотя бы за 2 года.
+    # 2. Кроме регионов с данными за последний год.
+    @staticmethod
+    def region_filter(values):
+        non_zero = values != 0
+        return (non_zero.sum(axis=1) >= 2) | non_zero[:, -1]
+
+    # Функция чтения регионов и выборки в соответствии с условиями.
+    # Возвращает регионы, матрицу значений (регионы x годы, от раннего года к позднему) и года
+    @staticmethod
+    def filter_regions(df):
+        year_columns = DataProcessor.locate_year_columns(df)
+        # Чтение регионов из колонки A с 4 строки
+        regions = df.iloc[2:, 0].values
+        # Чтение числовых значений из колонок с годами с 4 строки (колонки по умолчанию - E, D и C)
+        values = np.asfortranarray(df.iloc[2:, year_columns].astype(float).values)
+        # Года из третьей строки (индекс 2) и соответствующих столбцов
+        years = [df.iloc[1, j] for j in year_columns]
+
+        valid_filter = DiagramConstructor.region_filter(values)
+        regions, values = regions[valid_filter], values[valid_filter]
+
+        # Сортировка регионов по возрастанию относительно последнего года (колонка C)
+        sorted_indices = values[:, -1].argsort()
+        return regions[sorted_indices], values[sorted_indices], years
+
+    # Цвета рядов диаграммы по их количеству
+    @staticmethod
+    def series_colors(series_count):
+        if series_count <= len(DiagramConstructor.BASE_COLORS):
+            return DiagramConstructor.BASE_COLORS[len(DiagramConstructor.BASE_COLORS) - series_count:]
+        return [DiagramConstructor.PALETTE[j % len(DiagramConstructor.PALETTE)] for j in range(series_count)]
+
+    # Базовая функция генерации диаграмм: построение диаграммы одного листа через DiagramAPI
+    # и запись ее файлов в папку folder_name (единственное место записи диаграмм на диск)
+    @staticmethod
+    def make_diagrams(sheet_name, df, folder_name, render_params, pdf_pages=None, layouts=None):
+        result = DiagramAPI.render_sheet(sheet_name, df, render_params, pdf_pages, statistics=False, layouts=layouts)
+        FileUtils.write_images(folder_name, sheet_name, result.images)
+
+    # Построение фигуры диаграммы без сохранения
+    @staticmethod
+    def build_figure(df, standard_deviation, show_original_values, orientation, my_width, my_height, dpi=500):
+        regions, values, years = DiagramConstructor.filter_regions(df)
+        # Статистика по всем рядам за один проход
+        stats = SeriesStatistics.compute(values, standard_deviation)
+        return DiagramConstructor.draw_figure(regions, values, years, stats, show_original_values, orientation,
+                                              my_width, my_height, dpi)
+
+    # Построение фигуры по уже рассчитанной статистике листа (layouts - см. apply_layout)
+    @staticmethod
+    def draw_figure(regions, values, years, stats, show_original_values, orientation, my_width, my_height, dpi=500,
+                    layouts=None):
+        DiagramConstructor.import_matplotlib()
+        means, adjusted, white_cuts = stats['means'], stats['adjusted'], stats['white_cuts']
+
+        series_count = values.shape[1]
+        x = np.arange(len(regions))
+        width = DiagramConstructor.GROUP_WIDTH / series_count
+        offsets = (np.arange(series_count) - (series_count - 1) / 2) * width
+        colors = DiagramConstructor.series_colors(series_count)
+
+        fig = DiagramConstructor.acquire_figure(my_width, my_height, dpi)
+
+        # Генерация диаграммы
+        for j in range(series_count):
+            label = f'{str(int(years[j]))} — {int(round(means[j])):,}'.replace(',', ' ')
+            if orientation:
+                plt.bar(x + offsets[j], adjusted[:, j], width=width, label=label, color=colors[j])
+            else:
+                plt.barh(x + offsets[j], adjusted[:, j], height=width, label=label, color=colors[j])
 
         ax = plt.gca()
 
-        if orientation:
-            y_ticks = ax.get_yticks()
-            y_max_metric = 0
-            if len(y_ticks) >= 2:
-                y_max_metric = int(y_ticks[-2])  # Максимальная метрика из оси ординаты, используемая на графике
-
-            # Визуализация числовых значений сокращенных и превышающих максимальную метрику оси Y столбцов
-            if show_original_values:
-                for i in range(len(x)):
-                    if ((values_2[i] > threshold_2 and values_2[i] > max_non_outlier_value) or
-                            (values_2[i] > y_max_metric)):
-                        plt.text(x[i],
-                                 DiagramConstructor.bar_adjust(values_2[i], threshold_2, max_non_outlier_value)[0] +
-                                 3.5, f'{int(values_2[i]):,}'.replace(',', ' '), ha='center', va='bottom',
-                                 rotation=90, fontsize=5)
-                    if ((values_1[i] > threshold_1 and values_1[i] > max_non_outlier_value) or
-                            (values_1[i] > y_max_metric)):
-                        plt.text(x[i] - width,
-                                 DiagramConstructor.bar_adjust(values_1[i], threshold_1, max_non_outlier_value)[0] +
-                                 3.5, f'{int(values_1[i]):,}'.replace(',', ' '), ha='right', va='bottom',
-                                 rotation=90, fontsize=5)
-                    if ((values_3[i] > threshold_3 and values_3[i] > max_non_outlier_value) or
-                            (values_3[i] > y_max_metric)):
-                        plt.text(x[i] + width,
-                                 DiagramConstructor.bar_adjust(values_3[i], threshold_3, max_non_outlier_value)[0] +
-                                 3.5, f'{int(values_3[i]):,}'.replace(',', ' '), ha='left', va='bottom',
-                                 rotation=90, fontsize=5)
-
-            # Генерация пунктирных линий - средних значений за каждый год
-            plt.axhline(y=mean_1, color='#A5A5A5', linestyle='--', linewidth=0.8)
-            plt.axhline(y=mean_2, color='#ED7D31', linestyle='--', linewidth=0.8)
-            plt.axhline(y=mean_3, color='#5B9BD5', linestyle='--', linewidth=0.8)
+        # Подрисовка белых обрезаний у сокращенных столбиков
+        for j in range(series_count):
+            DiagramConstructor.add_white_section(ax, x + offsets[j], adjusted[:, j], white_cuts[:, j], width,
+                                                 orientation)
 
+        if orientation:
+            ticks = ax.get_yticks()
         else:
-            x_ticks = ax.get_xticks()
-            x_max_metric = 0
-            if len(x_ticks) >= 2:
-                x_max_metric = int(x_ticks[-2])
-
-            if show_original_values:
-                for i in range(len(x)):
-                    if ((values_2[i] > threshold_2 and values_2[i] > max_non_outlier_value) or
-                            (values_2[i] > x_max_metric)):
-                        plt.text(DiagramConstructor.bar_adjust(values_2[i], threshold_2, max_non_outlier_value)[0] +
-                                 3.5, x[i], f'{int(values_2[i]):,}'.replace(',', ' '), ha='left', va='center',
-                                 fontsize=5)
-                    if ((values_1[i] > threshold_1 and values_1[i] > max_non_outlier_value) or
-                            (values_1[i] > x_max_metric)):
-                        plt.text(DiagramConstructor.bar_adjust(values_1[i], threshold_1, max_non_outlier_value)[0] +
-                                 3.5, x[i] - width, f'{int(values_1[i]):,}'.replace(',', ' '), ha='left', va='bottom',
-                                 fontsize=5)
-                    if ((values_3[i] > threshold_3 and values_3[i] > max_non_outlier_value) or
-                            (values_3[i] > x_max_metric)):
-                        plt.text(DiagramConstructor.bar_adjust(values_3[i], threshold_3, max_non_outlier_value)[0] +
-                                 3.5, x[i] + width, f'{int(values_3[i]):,}'.replace(',', ' '), ha='left', va='top',
-                                 fontsize=5)
-            # Генерация пунктирных линий - средних значений за каждый год
-            plt.axvline(x=mean_1, color='#A5A5A5', linestyle='--', linewidth=0.8)
-            plt.axvline(x=mean_2, color='#ED7D31', linestyle='--', linewidth=0.8)
-            plt.axvline(x=mean_3, color='#5B9BD5', linestyle='--', linewidth=0.8)
+            ticks = ax.get_xticks()
+        max_metric = 0
+        if len(ticks) >= 2:
+            max_metric = int(ticks[-2])  # Максимальная метрика из оси значений, используемая на графике
+
+        # Визуализация числовых значений сокращенных и превышающих максимальную метрику оси значений столбцов.
+        # Подписи левых рядов выравниваются влево (вверх), правых - вправо (вниз), центрального - по центру
+        if show_original_values:
+            for j in range(series_count):
+                side = np.sign(offsets[j])
+                ha = {-1: 'right', 0: 'center', 1: 'left'}[side]
+                va = {-1: 'bottom', 0: 'center', 1: 'top'}[side]
+                DiagramConstructor.add_original_values(x + offsets[j], values[:, j], adjusted[:, j],
+                                                       white_cuts[:, j], max_metric, orientation, ha, va)
+
+        # Генерация пунктирных линий - средних значений за каждый год
+        for j in range(series_count):
+            if orientation:
+                plt.axhline(y=means[j], color=colors[j], linestyle='--', linewidth=0.8)
+            else:
+                plt.axvline(x=means[j], color=colors[j], linestyle='--', linewidth=0.8)
 
         # Настройки для повышенного качества, нормализации названия регионов и числового формата метрик
-        plt.legend(title='Среднее', labelcolor=['#A5A5A5', '#ED7D31', '#5B9BD5'], handlelength=0, frameon=False)
+        plt.legend(title='Среднее', labelcolor=colors, handlelength=0, frameon=False)
         plt.gca().spines['right'].set_visible(False)
         plt.gca().spines['top'].set_visible(False)
 
@@ -295,7 +763,7 @@ class DiagramConstructor:
             plt.yticks(x, regions, fontsize=6)
 
         plt.rcParams['text.antialiased'] = True
-        plt.tight_layout()
+        DiagramConstructor.apply_layout(fig, orientation, layouts)
 
         if orientation:
             plt.gca().yaxis.set_major_formatter(ScalarFormatter(useOffset=False))
@@ -306,18 +774,937 @@ class DiagramConstructor:
             plt.gca().xaxis.set_major_formatter(ScalarFormatter(useOffset=False))
             plt.ticklabel_format(style='plain', axis='x')
             ax.xaxis.set_major_formatter(ticker.FuncFormatter(lambda x, _: f'{int(x):,}'.replace(',', ' ')))
-        # Сохранение диаграммы
-        plt.savefig(f'{folder_name}/{sheet_name}.png', dpi=500, bbox_inches='tight')
-        plt.close()
+        return fig
+
+    # Размещение области диаграммы. layouts - отступы области диаграммы по размеру фигуры и ориентации,
+    # общие для листов одного документа: tight_layout выполняется для первого листа (см. reference_layout),
+    # следующие листы того же размера используют его отступы. Без layouts tight_layout выполняется для каждого листа
+    @staticmethod
+    def apply_layout(fig, orientation, layouts=None):
+        fig.layout_reused = False
+        if layouts is None:
+            fig.tight_layout()
+            return
+        key = (*fig.get_size_inches(), fig.dpi, orientation)
+        if key in layouts:
+            fig.subplots_adjust(**layouts[key])
+            fig.layout_reused = True
+        else:
+            fig.tight_layout()
+            layouts[key] = {name: getattr(fig.subplotpars, name) for name in ('left', 'right', 'bottom', 'top')}
+
+    # Границы содержимого фигуры. Если при общих отступах подписи выходят за пределы фигуры,
+    # для этой диаграммы выполняется собственный tight_layout (общие отступы не меняются)
+    @staticmethod
+    def fit_layout(fig, renderer):
+        tight = fig.get_tightbbox(renderer)
+        width, height = fig.get_size_inches()
+        if not getattr(fig, 'layout_reused', False) or (tight.x0 >= 0 and tight.y0 >= 0 and tight.x1 <= width
+                                                         and tight.y1 <= height):
+            return tight
+        fig.tight_layout()
+        return fig.get_tightbbox(renderer)
+
+    # Общие отступы документа по первому листу из sheet_names, для которого строится диаграмма. Фигура только
+    # размещается, без отрисовки и сохранения; результат не зависит от того, какие листы и в каком процессе строятся
+    @staticmethod
+    def reference_layout(sheets, sheet_names, render_params):
+        layouts = {}
+        for sheet in sheet_names:
+            try:
+                regions, values, years = DiagramConstructor.filter_regions(sheets[sheet])
+                stats = SeriesStatistics.compute(values, render_params.standard_deviation)
+                fig = DiagramConstructor.draw_figure(regions, values, years, stats,
+                                                     render_params.show_original_values, render_params.orientation,
+                                                     render_params.width, render_params.height, render_params.dpi,
+                                                     layouts)
+                DiagramConstructor.recycle_figure(fig)
+                return layouts
+            except Exception:
+                # Ошибка листа записывается при построении его диаграммы
+                if plt is not None:
+                    plt.close('all')
+        return layouts
+
+    # Сохранение диаграммы в файлы папки folder_name
+    @staticmethod
+    def save_figure(fig, sheet_name, folder_name, formats=('png',), dpi=500, pdf_pages=None):
+        images = DiagramConstructor.export_figure(fig, sheet_name, formats, dpi, pdf_pages)
+        FileUtils.write_images(folder_name, sheet_name, images)
+
+    # Сохранение диаграммы в память: фигура строится один раз и сохраняется во все форматы профиля,
+    # а границы 'tight' вычисляются один раз, а не отдельной отрисовкой при каждом сохранении.
+    # Возвращает словарь формат -> содержимое файла; формат 'book' добавляет страницу в pdf_pages
+    @staticmethod
+    def export_figure(fig, sheet_name, formats=('png',), dpi=500, pdf_pages=None):
+        images = {}
+        with Instrumentation.stage('layout', sheet_name):
+            bbox = DiagramConstructor.fit_layout(fig, fig.canvas.get_renderer()).padded(
+                plt.rcParams['savefig.pad_inches'])
+        with Instrumentation.stage('savefig', sheet_name):
+            for fmt in formats:
+                if fmt == 'book':
+                    pdf_pages.savefig(fig, bbox_inches=bbox)
+                elif fmt == 'png' and fig.dpi == dpi:
+                    images[fmt] = DiagramConstructor.crop_png(fig, bbox)
+                else:
+                    buffer = io.BytesIO()
+                    fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches=bbox)
+                    images[fmt] = buffer.getvalue()
+        DiagramConstructor.recycle_figure(fig)
+        return images
+
+    # PNG диаграммы без изменения размера холста: фигура отрисовывается в буфер своего размера, который
+    # сохраняется между листами, а изображение вырезается из буфера по границам bbox (в дюймах).
+    # savefig с bbox_inches изменил бы размер холста и создал бы новый буфер отрисовки для каждого листа.
+    # Части bbox за пределами фигуры заполняются цветом фона
+    @staticmethod
+    def crop_png(fig, bbox):
+        fig.canvas.draw()
+        rgba = np.asarray(fig.canvas.buffer_rgba())
+        height, width = rgba.shape[:2]
+        left = int(round(bbox.x0 * fig.dpi))
+        top = int(round(height - bbox.y1 * fig.dpi))
+        crop_width, crop_height = int(bbox.width * fig.dpi), int(bbox.height * fig.dpi)
+        if left >= 0 and top >= 0 and left + crop_width <= width and top + crop_height <= height:
+            image = rgba[top:top + crop_height, left:left + crop_width]
+        else:
+            image = np.empty((crop_height, crop_width, 4), dtype=np.uint8)
+            image[:] = np.round(np.array(fig.get_facecolor()) * 255).astype(np.uint8)
+            x0, y0 = max(left, 0), max(top, 0)
+            x1, y1 = min(left + crop_width, width), min(top + crop_height, height)
+            image[y0 - top:y1 - top, x0 - left:x1 - left] = rgba[y0:y1, x0:x1]
+        buffer = io.BytesIO()
+        plt.imsave(buffer, image, format='png', dpi=fig.dpi)
+        return buffer.getvalue()
+
+    # Фигура для построения диаграммы. Каждый процесс хранит одну фигуру и использует ее для всех листов
+    # одного размера: вместо создания новой фигуры удаляются элементы предыдущей диаграммы, а холст
+    # и буфер отрисовки того же размера сохраняются. Фигура другого размера заменяет сохраненную
+    @staticmethod
+    def acquire_figure(my_width, my_height, dpi):
+        key = (my_width, my_height, dpi)
+        fig = DiagramConstructor.figure
+        if fig is not None and DiagramConstructor.figure_key == key and plt.fignum_exists(fig.number):
+            plt.figure(fig.number)
+            fig.clear()
+            # Отступы, измененные tight_layout предыдущей диаграммы, возвращаются к значениям по умолчанию
+            fig.subplots_adjust(**{name: plt.rcParams[f'figure.subplot.{name}']
+                                   for name in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')})
+            return fig
+        DiagramConstructor.release_figure()
+        DiagramConstructor.figure = plt.figure(figsize=(my_width, my_height), dpi=dpi)
+        DiagramConstructor.figure_key = key
+        return DiagramConstructor.figure
+
+    # Очистка фигуры после сохранения: сохраненная фигура остается для следующего листа, остальные закрываются
+    @staticmethod
+    def recycle_figure(fig):
+        if fig is DiagramConstructor.figure:
+            fig.clear()
+        else:
+            plt.close(fig)
+
+    # Закрытие сохраненной фигуры (освобождение буфера отрисовки)
+    @staticmethod
+    def release_figure():
+        if DiagramConstructor.figure is not None:
+            plt.close(DiagramConstructor.figure)
+        DiagramConstructor.figure = DiagramConstructor.figure_key = None
+
+
+# Параметры построения диаграмм (значения по умолчанию совпадают с параметрами parameters.txt по умолчанию)
+@dataclass
+class RenderParameters:
+    standard_deviation: float = 4
+    show_original_values: bool = True
+    orientation: bool = True
+    width: float = 10
+    height: float = 6
+    formats: list = field(default_factory=lambda: ['png'])
+    dpi: int = 500
+    # Колонки со значениями (см. FileUtils.parse_columns), None - колонки C, D и E
+    columns: Optional[str] = None
+
+    # Определение форматов и разрешения по профилю; параметры formats и dpi переопределяют значения профиля
+    @staticmethod
+    def resolve_profile(params):
+        profile_name = params.get('profile', 'final')
+        if profile_name not in DiagramConstructor.RENDER_PROFILES:
+            raise ValueError(f"Неизвестный профиль '{profile_name}'. Доступные профили: "
+                             f"{', '.join(DiagramConstructor.RENDER_PROFILES)}")
+        profile = DiagramConstructor.RENDER_PROFILES[profile_name]
+        formats = params.get('formats', profile['formats'])
+        unsupported = [fmt for fmt in formats if fmt not in DiagramConstructor.SUPPORTED_FORMATS]
+        if unsupported:
+            raise ValueError(f"Форматы {', '.join(unsupported)} не поддерживаются.")
+        return formats, params.get('dpi', profile['dpi'])
+
+    # Параметры из словаря, прочитанного DataProcessor.read_parameters_from_file
+    @staticmethod
+    def from_params(params):
+        formats, dpi = RenderParameters.resolve_profile(params)
+        FileUtils.parse_columns(params.get('columns'))
+        return RenderParameters(
+            standard_deviation=params.get('standard_deviation', 4),
+            show_original_values=params.get('show_original_values', True),
+            orientation=params.get('orientation', True),
+            width=params.get('width', 10),
+            height=params.get('height', 6),
+            formats=formats,
+            dpi=dpi,
+            columns=params.get('columns'),
+        )
+
+
+# Результат построения диаграммы одного листа: файлы диаграммы в памяти (формат -> bytes) и статистика
+@dataclass
+class SheetResult:
+    sheet: Optional[str]
+    images: dict = field(default_factory=dict)
+    statistics: Optional['pd.DataFrame'] = None
+    summary: Optional['pd.DataFrame'] = None
+    error: Optional[str] = None
+
+
+# Результат обработки документа: результаты листов и, для формата 'book', единый PDF
+@dataclass
+class RenderResult:
+    sheets: list = field(default_factory=list)
+    book: Optional[bytes] = None
+
+    def images(self, fmt='png'):
+        return {result.sheet: result.images[fmt] for result in self.sheets if fmt in result.images}
+
+
+# Программный интерфейс без обращения к файловой системе: документ передается как DataFrame, словарь DataFrame,
+# bytes, файловый объект или путь, а диаграммы и статистика возвращаются в памяти.
+# Построение использует pyplot, поэтому вызовы из нескольких потоков одного процесса нужно разделять
+class DiagramAPI:
+    # Загрузка листов документа с выбором колонок по параметру columns
+    @staticmethod
+    def load(source, params=None, file_format=None, chunk_size=FileUtils.CSV_CHUNK_SIZE):
+        params = params or RenderParameters()
+        usecols = FileUtils.parse_columns(params.columns)
+        if isinstance(source, pd.DataFrame):
+            return {None: FileUtils.select_columns(source, usecols)}
+        if isinstance(source, dict):
+            return {name: FileUtils.select_columns(df, usecols) for name, df in source.items()}
+        return FileUtils.load_sheets(source, usecols, file_format, chunk_size)
+
+    # Построение диаграммы и расчет статистики одного листа. Ошибки построения передаются вызывающему коду
+    @staticmethod
+    def render_sheet(sheet_name, df, params=None, pdf_pages=None, statistics=True, layouts=None):
+        params = params or RenderParameters()
+        with Instrumentation.stage('figure', sheet_name):
+            regions, values, years = DiagramConstructor.filter_regions(df)
+            stats = SeriesStatistics.compute(values, params.standard_deviation)
+            fig = DiagramConstructor.draw_figure(regions, values, years, stats, params.show_original_values,
+                                                 params.orientation, params.width, params.height, params.dpi,
+                                                 layouts)
+        images = DiagramConstructor.export_figure(fig, sheet_name, params.formats, params.dpi, pdf_pages)
+        result = SheetResult(sheet_name, images)
+        if statistics:
+            result.statistics, result.summary = SeriesStatistics.tables(sheet_name, regions, values, years, stats)
+        return result
+
+    # Обработка документа целиком: sheets - список листов для построения (по умолчанию все валидные листы).
+    # Ошибка построения листа записывается в SheetResult.error и не прерывает обработку остальных
+    @staticmethod
+    def render(source, params=None, sheets=None, file_format=None, statistics=True):
+        params = params or RenderParameters()
+        loaded = DiagramAPI.load(source, params, file_format)
+        book_sheets = DataProcessor.load_valid_sheets(loaded)
+        valid_sheets = book_sheets if sheets is None else [sheet for sheet in book_sheets if sheet in sheets]
+        result = RenderResult()
+        # Общие отступы всех диаграмм документа задаются первым валидным листом
+        layouts = DiagramConstructor.reference_layout(loaded, book_sheets, params) if valid_sheets else {}
+        book = io.BytesIO() if 'book' in params.formats else None
+        if book is not None:
+            DiagramConstructor.import_matplotlib()
+        with PdfPages(book) if book is not None else contextlib.nullcontext() as pdf_pages:
+            for sheet in valid_sheets:
+                try:
+                    result.sheets.append(DiagramAPI.render_sheet(sheet, loaded[sheet], params, pdf_pages,
+                                                                 statistics, layouts))
+                except Exception as e:
+                    logging.error(f"Ошибка при построении диаграммы листа '{sheet}': {str(e)}")
+                    if plt is not None:
+                        plt.close('all')
+                    result.sheets.append(SheetResult(sheet, error=str(e)))
+        if book is not None:
+            result.book = book.getvalue()
+        return result
+
+
+# Набор функций инкрементального режима: манифест с хешами листов и параметров построения
+class BuildCache:
+    MANIFEST_FILE = 'manifest.json'
+    # Версия формата диаграмм: при изменении способа построения все листы перестраиваются
+    VERSION = 1
+
+    # Хеш содержимого листа (колонки A, C, D, E вместе со строкой годов)
+    @staticmethod
+    def sheet_hash(df):
+        digest = hashlib.sha256()
+        digest.update(str(df.shape).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        return digest.hexdigest()
+
+    # Хеш параметров, влияющих на вид диаграмм
+    @staticmethod
+    def params_hash(render_params):
+        payload = json.dumps({'version': BuildCache.VERSION, **asdict(render_params)}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def load_manifest(folder_name):
+        manifest_path = os.path.join(folder_name, BuildCache.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {'params': None, 'sheets': {}}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Ошибка при чтении манифеста '{manifest_path}': {str(e)}")
+            return {'params': None, 'sheets': {}}
+
+    @staticmethod
+    def save_manifest(folder_name, manifest):
+        manifest_path = os.path.join(folder_name, BuildCache.MANIFEST_FILE)
+        with open(manifest_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+
+    # Разделение листов на неизменившиеся (hits) и требующие перестроения (misses).
+    # Лист считается неизменившимся, если совпадают хеши листа и параметров, а диаграмма существует
+    @staticmethod
+    def split_sheets(manifest, sheet_hashes, params_hash, folder_name, formats):
+        hits, misses = [], []
+        same_params = manifest.get('params') == params_hash
+        sheet_formats = [fmt for fmt in formats if fmt != 'book']
+        for sheet, sheet_hash in sheet_hashes.items():
+            if (same_params and manifest['sheets'].get(str(sheet)) == sheet_hash and
+                    all(os.path.exists(f'{folder_name}/{sheet}.{fmt}') for fmt in sheet_formats)):
+                hits.append(sheet)
+            else:
+                misses.append(sheet)
+        return hits, misses
+
+    # Запись в манифест хешей успешно построенных листов
+    @staticmethod
+    def update_manifest(manifest, rendered_sheets, sheet_hashes, params_hash):
+        if manifest.get('params') != params_hash:
+            manifest = {'params': params_hash, 'sheets': {}}
+        for sheet in rendered_sheets:
+            manifest['sheets'][str(sheet)] = sheet_hashes[sheet]
+        return manifest
+
+
+# Замеры времени и памяти по этапам и листам с итоговым JSON отчетом о запуске.
+# Пока замеры не включены (active is None), Instrumentation.stage возвращает пустой контекст
+class Instrumentation:
+    # Активный сборщик замеров текущего процесса
+    active = None
+
+    def __init__(self):
+        self.records = []
+        self.errors = []
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    # Пиковое потребление памяти процессом в килобайтах
+    @staticmethod
+    def peak_memory_kb():
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # На macOS ru_maxrss возвращается в байтах
+            return peak // 1024 if sys.platform == 'darwin' else peak
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.PeakWorkingSetSize // 1024
+        return None
+
+    # Замер этапа name для листа sheet (или всего документа, если sheet не задан)
+    @staticmethod
+    def stage(name, sheet=None):
+        if Instrumentation.active is None:
+            return contextlib.nullcontext()
+        return Instrumentation.active.measure(name, sheet)
+
+    @staticmethod
+    def record_error(name, sheet, error):
+        if Instrumentation.active is not None:
+            Instrumentation.active.errors.append({'stage': name, 'sheet': sheet, 'error': str(error)})
+
+    @contextlib.contextmanager
+    def measure(self, name, sheet=None):
+        peak_before = Instrumentation.peak_memory_kb()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            peak_after = Instrumentation.peak_memory_kb()
+            self.records.append({
+                'stage': name,
+                'sheet': sheet,
+                'wall_s': time.perf_counter() - wall,
+                'cpu_s': time.process_time() - cpu,
+                'peak_memory_kb': peak_after,
+                'peak_growth_kb': peak_after - peak_before if peak_after is not None else None,
+                'pid': os.getpid(),
+            })
+
+    # Итоговый отчет: суммы по этапам и листам, самые медленные листы и ошибки.
+    # В параллельном режиме замеры этапов приходят из процессов пула, а общее время CPU - только главного процесса
+    def build_report(self, file_path, folder_name, workers, slowest=10):
+        stages = {}
+        sheets = {}
+        for record in self.records:
+            stage = stages.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                        'max_peak_growth_kb': 0})
+            stage['count'] += 1
+            stage['wall_s'] += record['wall_s']
+            stage['cpu_s'] += record['cpu_s']
+            stage['max_peak_growth_kb'] = max(stage['max_peak_growth_kb'], record['peak_growth_kb'] or 0)
+            if record['sheet'] is not None:
+                sheet = sheets.setdefault(str(record['sheet']), {'wall_s': 0.0, 'cpu_s': 0.0, 'stages': {}})
+                sheet['wall_s'] += record['wall_s']
+                sheet['cpu_s'] += record['cpu_s']
+                sheet['stages'][record['stage']] = sheet['stages'].get(record['stage'], 0.0) + record['wall_s']
+        peak_values = [record['peak_memory_kb'] for record in self.records if record['peak_memory_kb'] is not None]
+        main_peak = Instrumentation.peak_memory_kb()
+        if main_peak is not None:
+            peak_values.append(main_peak)
+        slowest_sheets = sorted(sheets.items(), key=lambda item: item[1]['wall_s'], reverse=True)[:slowest]
+        return {
+            'file': file_path,
+            'folder': folder_name,
+            'workers': workers,
+            'totals': {
+                'wall_s': time.perf_counter() - self.started_wall,
+                'cpu_s': time.process_time() - self.started_cpu,
+                'stages_cpu_s': sum(stage['cpu_s'] for stage in stages.values()),
+                'peak_memory_kb': max(peak_values) if peak_values else None,
+                'sheets': len(sheets),
+            },
+            'stages': stages,
+            'slowest_sheets': [{'sheet': name, **values} for name, values in slowest_sheets],
+            'sheets': sheets,
+            'errors': {'count': len(self.errors), 'items': self.errors},
+        }
+
+    def save_report(self, report_path, file_path, folder_name, workers):
+        with open(report_path, 'w', encoding='utf-8') as file:
+            json.dump(self.build_report(file_path, folder_name, workers), file, ensure_ascii=False, indent=2)
+
+
+# Постоянно работающий локальный HTTP сервис: библиотеки, шрифты и процессы пула загружаются один раз при запуске,
+# а задачи построения диаграмм принимаются через HTTP и выполняются из ограниченной очереди
+class RenderService:
+    # Количество хранимых завершенных задач
+    MAX_FINISHED_JOBS = 1000
+
+    def __init__(self, output_dir, workers, queue_size, base_params, budget=None):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.base_params = base_params
+        # Общий для всех задач бюджет памяти построения диаграмм
+        self.budget = budget or MemoryBudget()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        # Пул процессов заменяется, если процесс пула аварийно завершился (см. restart_executor)
+        self.executor_lock = threading.Lock()
+        self.broken = False
+        self.started = time.time()
+        self.metrics = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'running': 0,
+                        'job_seconds_total': 0.0}
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Прогрев: построение маленькой диаграммы загружает шрифты и бэкенд в каждом процессе пула
+    @staticmethod
+    def warm_up():
+        DiagramConstructor.import_matplotlib()
+        fig = plt.figure(figsize=(1, 1), dpi=72)
+        plt.bar([0], [1], label='0')
+        plt.legend()
+        fig.canvas.draw()
+        plt.close(fig)
+        return os.getpid()
+
+    def start(self):
+        self.warm_up_executor(self.executor)
+        # Задачи одновременно обрабатываются несколькими потоками, а диаграммы строятся в общем пуле процессов
+        for _ in range(self.workers):
+            threading.Thread(target=self.dispatch, daemon=True).start()
+
+    def warm_up_executor(self, executor):
+        for future in [executor.submit(RenderService.warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    # Замена сломанного пула процессов (процесс пула завершился аварийно, например при нехватке памяти)
+    # новым прогретым пулом. Пока пул не заменен, /health возвращает статус 'degraded'.
+    # Пул заменяется один раз, даже если его ошибку получили несколько задач
+    def restart_executor(self, broken_executor):
+        with self.executor_lock:
+            if self.executor is not broken_executor and not self.broken:
+                return
+            self.broken = True
+            logging.error("Процесс пула аварийно завершился, пул процессов перезапускается")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            try:
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+                self.executor = executor
+                self.warm_up_executor(executor)
+                self.broken = False
+            except Exception as e:
+                # Пул будет заменен снова при следующей задаче
+                logging.error(f"Ошибка при перезапуске пула процессов: {str(e)}")
+
+    # Постановка задачи в очередь. Если очередь заполнена, задача отклоняется (None).
+    # upload_dir - временная папка загруженного документа, удаляется после выполнения задачи
+    def submit(self, file_path, params, upload_dir=None):
+        job_id = uuid.uuid4().hex
+        job = {'id': job_id, 'status': 'queued', 'file': os.path.basename(file_path), 'files': [],
+               'errors': [], 'created': time.time(), 'done': threading.Event(), 'upload_dir': upload_dir}
+        try:
+            self.queue.put_nowait((job, file_path, params))
+        except queue.Full:
+            with self.lock:
+                self.metrics['rejected'] += 1
+            return None
+        with self.lock:
+            self.jobs[job_id] = job
+            self.metrics['submitted'] += 1
+            self.forget_finished_jobs()
+        return job
+
+    # Удаление самых старых завершенных задач вместе с папками их диаграмм
+    def forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['done'].is_set()]
+        for job_id in finished[:max(0, len(finished) - RenderService.MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+            shutil.rmtree(os.path.join(self.output_dir, job_id), ignore_errors=True)
+
+    def dispatch(self):
+        while True:
+            job, file_path, params = self.queue.get()
+            with self.lock:
+                job['status'] = 'running'
+                self.metrics['running'] += 1
+            started = time.perf_counter()
+            try:
+                self.process(job, file_path, params)
+                job['status'] = 'done'
+            except Exception as e:
+                logging.error(f"Ошибка при выполнении задачи '{job['id']}': {str(e)}")
+                job['errors'].append(str(e))
+                job['status'] = 'failed'
+            if job['upload_dir'] is not None:
+                shutil.rmtree(job['upload_dir'], ignore_errors=True)
+            with self.lock:
+                self.metrics['running'] -= 1
+                self.metrics['completed' if job['status'] == 'done' else 'failed'] += 1
+                self.metrics['job_seconds_total'] += time.perf_counter() - started
+            job['done'].set()
+            self.queue.task_done()
+
+    # Выполнение задачи: те же шаги, что и в MainApp.process, но диаграммы строятся в общем пуле процессов
+    def process(self, job, file_path, params):
+        render_params = RenderParameters.from_params(params)
+        if 'book' in render_params.formats:
+            raise ValueError("Формат 'book' не поддерживается сервисом.")
+        folder_name = os.path.join(self.output_dir, job['id'])
+        os.makedirs(folder_name, exist_ok=True)
+        sheets = DiagramAPI.load(file_path, render_params,
+                                 chunk_size=params.get('chunk_size', FileUtils.CSV_CHUNK_SIZE))
+        valid_sheets = book_sheets = DataProcessor.load_valid_sheets(sheets)
+        number = params.get('number', 0)
+        if number != 0:
+            valid_sheets = [valid_sheets[number - 1]]
+        if not valid_sheets:
+            raise ValueError("Нет валидных листов для обработки.")
+        # Пул мог сломаться и до этой задачи, поэтому после замены пула задача выполняется еще раз
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                rendered_sheets = MainApp.render_sheets(sheets, valid_sheets, folder_name, render_params,
+                                                        self.workers, executor=executor, budget=self.budget,
+                                                        reference_sheets=book_sheets)
+                break
+            except BrokenProcessPool:
+                self.restart_executor(executor)
+                if attempt:
+                    raise ValueError("Процесс построения диаграмм аварийно завершился.")
+        job['errors'].extend(f"Ошибка при построении диаграммы листа '{sheet}'"
+                             for sheet in valid_sheets if sheet not in rendered_sheets)
+        job['files'] = [f'{sheet}.{fmt}' for sheet in rendered_sheets for fmt in render_params.formats]
+
+    def job_info(self, job):
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'file': job['file'],
+            'files': [f"/jobs/{job['id']}/files/{urllib.parse.quote(name)}" for name in job['files']],
+            'errors': job['errors'],
+        }
+
+    def health(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        finished = metrics['completed'] + metrics['failed']
+        return {
+            'status': 'degraded' if self.broken else 'ok',
+            'uptime_s': time.time() - self.started,
+            'workers': self.workers,
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'jobs': metrics,
+            'avg_job_seconds': metrics['job_seconds_total'] / finished if finished else None,
+        }
+
+    # Параметры запроса: значения из parameters.txt сервиса, переопределенные параметрами запроса
+    def request_params(self, values):
+        pairs = [(key, ','.join(value) if isinstance(value, list) else str(value)) for key, value in values.items()]
+        return {**self.base_params, **DataProcessor.parse_parameters(pairs)}
+
+    # Обработчик HTTP запросов:
+    # POST /render?filename=<имя>.xlsx&<параметры> - тело запроса содержит табличный документ;
+    # POST /render (JSON {"path": ..., "params": {...}}) - документ на диске сервиса;
+    # параметр wait=true дожидается построения диаграмм, иначе возвращается идентификатор задачи.
+    # GET /jobs/<id>, GET /jobs/<id>/files/<имя>, GET /health, GET /metrics
+    @staticmethod
+    def make_handler(service):
+        from http.server import BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = [urllib.parse.unquote(part) for part in urllib.parse.urlsplit(self.path).path.split('/') if part]
+                if parts in (['health'], ['metrics']):
+                    self.send_json(200, service.health())
+                    return
+                job = service.jobs.get(parts[1]) if len(parts) >= 2 and parts[0] == 'jobs' else None
+                if job is None:
+                    self.send_json(404, {'error': 'Не найдено'})
+                elif len(parts) == 2:
+                    self.send_json(200, service.job_info(job))
+                elif len(parts) == 4 and parts[2] == 'files' and parts[3] in job['files']:
+                    with open(os.path.join(service.output_dir, job['id'], parts[3]), 'rb') as file:
+                        body = file.read()
+                    content_type = mimetypes.guess_type(parts[3])[0] or 'application/octet-stream'
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_json(404, {'error': 'Не найдено'})
+
+            def do_POST(self):
+                url = urllib.parse.urlsplit(self.path)
+                if url.path != '/render':
+                    self.send_json(404, {'error': 'Не найдено'})
+                    return
+                query = dict(urllib.parse.parse_qsl(url.query))
+                wait = query.pop('wait', 'false').lower() == 'true'
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                upload_dir = None
+                try:
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        request = json.loads(body)
+                        if not isinstance(request, dict) or not isinstance(request.get('params', {}), dict):
+                            raise ValueError("Тело запроса должно быть объектом {\"path\": ..., \"params\": {...}}.")
+                        file_path = request['path']
+                        if not isinstance(file_path, str):
+                            raise ValueError("Поле path должно быть строкой.")
+                        params = service.request_params({**query, **request.get('params', {})})
+                    else:
+                        filename = os.path.basename(query.pop('filename', 'upload.xlsx'))
+                        upload_dir = tempfile.mkdtemp(dir=service.output_dir, prefix='upload_')
+                        file_path = os.path.join(upload_dir, filename)
+                        with open(file_path, 'wb') as file:
+                            file.write(body)
+                        params = service.request_params(query)
+                    if not FileUtils.is_valid_file(file_path) or not os.path.exists(file_path):
+                        raise ValueError("Неверный формат файла или файл не найден.")
+                except (ValueError, KeyError) as e:
+                    if upload_dir is not None:
+                        shutil.rmtree(upload_dir, ignore_errors=True)
+                    self.send_json(400, {'error': str(e)})
+                    return
+                job = service.submit(file_path, params, upload_dir)
+                if job is None:
+                    if upload_dir is not None:
+                        shutil.rmtree(upload_dir, ignore_errors=True)
+                    self.send_json(503, {'error': 'Очередь задач заполнена'})
+                    return
+                if wait:
+                    job['done'].wait()
+                    self.send_json(200, service.job_info(job))
+                else:
+                    self.send_json(202, service.job_info(job))
+
+            def log_message(self, format, *args):
+                # Ошибки записываются в error.log, остальные сообщения сервера не выводятся
+                pass
+
+        return Handler
+
+    @staticmethod
+    def serve(args):
+        params = {}
+        if os.path.exists('parameters.txt'):
+            params = DataProcessor.read_parameters_from_file('parameters.txt')
+        budget = MainApp.resolve_memory_budget(args.memory_budget, params)
+        # Каждый процесс пула хранит одну фигуру: количество процессов ограничено бюджетом для параметров по умолчанию
+        workers = budget.max_workers(MainApp.resolve_workers(args.workers, params),
+                                     MemoryBudget.estimate(RenderParameters.from_params(params)))
+        service = RenderService(args.output_dir, workers, args.queue_size, params, budget)
+        service.start()
+        from http.server import ThreadingHTTPServer
+        server = ThreadingHTTPServer((args.host, args.port), RenderService.make_handler(service))
+        print(f"Сервис запущен: http://{args.host}:{args.port} (процессов: {workers})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.executor.shutdown(cancel_futures=True)
+
+
+# Ограничение количества одновременно строящихся диаграмм по оценке занимаемой ими памяти.
+# Общий для всех задач объект: задача ожидает, пока оценка памяти уже строящихся диаграмм не освободит место
+class MemoryBudget:
+    def __init__(self, limit_mb=0):
+        # 0 - без ограничения
+        self.limit = int(limit_mb * 1024 * 1024)
+        self.used = 0
+        self.condition = threading.Condition()
+
+    # Оценка памяти построения одной диаграммы в байтах: буфер RGBA фигуры (4 байта на пиксель
+    # при размере width x height дюймов и разрешении dpi) и буфер сохраняемого изображения того же размера
+    @staticmethod
+    def estimate(render_params):
+        pixels = int(render_params.width * render_params.dpi) * int(render_params.height * render_params.dpi)
+        return 2 * 4 * pixels
+
+    # Количество процессов, фигуры которых одновременно помещаются в бюджет (не меньше одного)
+    def max_workers(self, workers, cost):
+        if not self.limit:
+            return workers
+        return max(1, min(workers, self.limit // cost))
+
+    # Диаграмма, оценка которой больше всего бюджета, строится, когда других диаграмм не строится
+    def acquire(self, cost):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.limit or self.used == 0 or self.used + cost <= self.limit)
+            self.used += cost
+
+    def release(self, cost):
+        with self.condition:
+            self.used -= cost
+            self.condition.notify_all()
 
 
 # Главная база программы
 class MainApp:
+    # Разбор аргументов командной строки (путь к документу и дополнительные флаги)
+    @staticmethod
+    def parse_arguments(argv):
+        parser = argparse.ArgumentParser(prog='parserDiagramsV2')
+        parser.add_argument('file_path', nargs='?', help="Путь к табличному документу")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Количество процессов для построения диаграмм (0 - по числу ядер)")
+        parser.add_argument('--incremental', action='store_true', default=None,
+                            help="Перестраивать только изменившиеся листы")
+        parser.add_argument('--report', action='store_true', default=None,
+                            help="Записать JSON отчет с замерами времени и памяти по этапам")
+        parser.add_argument('--cprofile', action='store_true', default=None,
+                            help="Сохранить профиль cProfile главного процесса")
+        parser.add_argument('--memory-budget', type=float, default=None,
+                            help="Бюджет памяти одновременно строящихся диаграмм в МБ (0 - без ограничения)")
+        parser.add_argument('--list-sheets', action='store_true',
+                            help="Вывести листы \"Рис\" и их года без загрузки pandas и matplotlib")
+        parser.add_argument('--validate', action='store_true',
+                            help="Проверить листы \"Рис\" (года и числовые значения) без построения диаграмм")
+        parser.add_argument('--stats-only', action='store_true',
+                            help="Только рассчитать статистику листов без построения диаграмм")
+        parser.add_argument('--serve', action='store_true',
+                            help="Запустить локальный HTTP сервис построения диаграмм")
+        parser.add_argument('--host', default='127.0.0.1', help="Адрес сервиса")
+        parser.add_argument('--port', type=int, default=8765, help="Порт сервиса")
+        parser.add_argument('--queue-size', type=int, default=16, help="Максимальное количество задач в очереди")
+        parser.add_argument('--output-dir', default='GraphicsService', help="Папка для диаграмм сервиса")
+        return parser.parse_args(argv)
+
+    # Определение количества процессов: флаг командной строки важнее параметра workers из parameters.txt
+    @staticmethod
+    def resolve_workers(cli_workers, params):
+        workers = cli_workers if cli_workers is not None else params.get('workers', 1)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return workers
+
+    # Бюджет памяти построения диаграмм в мегабайтах: флаг командной строки важнее параметра memory_budget
+    @staticmethod
+    def resolve_memory_budget(cli_budget, params):
+        return MemoryBudget(cli_budget if cli_budget is not None else params.get('memory_budget', 0))
+
+    # Построение диаграммы одного листа (в том числе в процессе пула) и запись файлов в папку.
+    # При включенных замерах возвращает замеры этапов этого листа, которые затем добавляются в общий отчет
+    @staticmethod
+    def render_task(sheet, df, folder_name, render_params, instrumented=False, pdf_pages=None, layouts=None):
+        previous = Instrumentation.active
+        Instrumentation.active = Instrumentation() if instrumented else None
+        try:
+            DiagramConstructor.make_diagrams(sheet, df, folder_name, render_params, pdf_pages, layouts)
+            return Instrumentation.active.records if instrumented else []
+        finally:
+            Instrumentation.active = previous
+
+    @staticmethod
+    def report_render_error(sheet, error):
+        logging.error(f"Ошибка при построении диаграммы листа '{sheet}': {str(error)}")
+        print(f"Ошибка при построении диаграммы листа '{sheet}': {error}")
+        Instrumentation.record_error('render', sheet, error)
+
+    # Построение диаграмм выбранных листов последовательно или в пуле процессов.
+    # Ошибка построения одного листа записывается в лог и не прерывает обработку остальных.
+    # Единый PDF (формат 'book') собирается в одном процессе, поэтому в этом случае листы строятся последовательно.
+    # Возвращает список успешно построенных листов. Если передан executor (уже запущенный пул процессов сервиса),
+    # листы строятся в нем, и пул после построения не закрывается.
+    # Отступы диаграмм задаются первым листом из reference_sheets (по умолчанию valid_sheets) и одинаковы
+    # при последовательном и параллельном построении
+    @staticmethod
+    def render_sheets(sheets, valid_sheets, folder_name, render_params, workers, book_path=None, executor=None,
+                      budget=None, reference_sheets=None):
+        rendered_sheets = []
+        instrumented = Instrumentation.active is not None
+        budget = budget or MemoryBudget()
+        cost = MemoryBudget.estimate(render_params)
+        reference_sheets = reference_sheets or valid_sheets
+        if executor is None:
+            # Каждый процесс пула хранит одну фигуру, поэтому количество процессов ограничено бюджетом памяти
+            workers = budget.max_workers(workers, cost)
+        if book_path is None and (executor is not None or (workers > 1 and len(valid_sheets) > 1)):
+            shared = executor is not None
+            if executor is None:
+                pool = ProcessPoolExecutor(max_workers=min(workers, len(valid_sheets)))
+            else:
+                pool = contextlib.nullcontext(executor)
+            with pool as executor:
+                layouts = MainApp.reference_layouts(sheets, reference_sheets, render_params, executor, budget, cost)
+                futures = {}
+                for sheet in valid_sheets:
+                    budget.acquire(cost)
+                    try:
+                        future = executor.submit(MainApp.render_task, sheet, sheets[sheet], folder_name,
+                                                 render_params, instrumented, None, layouts)
+                    except Exception:
+                        budget.release(cost)
+                        raise
+                    future.add_done_callback(lambda _: budget.release(cost))
+                    futures[future] = sheet
+                broken = None
+                for future in as_completed(futures):
+                    sheet = futures[future]
+                    try:
+                        records = future.result()
+                        rendered_sheets.append(sheet)
+                        if instrumented:
+                            Instrumentation.active.records.extend(records)
+                    except Exception as e:
+                        MainApp.report_render_error(sheet, e)
+                        if isinstance(e, BrokenProcessPool):
+                            broken = e
+                # Сломанный пул сервиса передается вызывающему коду, который заменяет пул
+                if broken is not None and shared:
+                    raise broken
+        else:
+            DiagramConstructor.import_matplotlib()
+            layouts = DiagramConstructor.reference_layout(sheets, reference_sheets, render_params) \
+                if valid_sheets else {}
+            with PdfPages(book_path) if book_path is not None else contextlib.nullcontext() as pdf_pages:
+                for sheet in valid_sheets:
+                    try:
+                        records = MainApp.render_task(sheet, sheets[sheet], folder_name, render_params, instrumented,
+                                                      pdf_pages, layouts)
+                        rendered_sheets.append(sheet)
+                        if instrumented:
+                            Instrumentation.active.records.extend(records)
+                    except Exception as e:
+                        MainApp.report_render_error(sheet, e)
+                        plt.close('all')
+        return rendered_sheets
+
+    # Общие отступы документа, рассчитанные в процессе пула (pyplot используется только в процессах пула):
+    # листы передаются по одному, пока для одного из них не будет построена диаграмма
+    @staticmethod
+    def reference_layouts(sheets, reference_sheets, render_params, executor, budget, cost):
+        for sheet in reference_sheets:
+            budget.acquire(cost)
+            try:
+                layouts = executor.submit(DiagramConstructor.reference_layout, {sheet: sheets[sheet]}, [sheet],
+                                          render_params).result()
+            finally:
+                budget.release(cost)
+            if layouts:
+                return layouts
+        return {}
+
+    # Инкрементальное построение: диаграммы строятся только для листов, изменившихся с прошлого запуска
+    @staticmethod
+    def render_incremental(sheets, valid_sheets, folder_name, render_params, workers, book_path=None, budget=None,
+                           reference_sheets=None):
+        sheet_hashes = {sheet: BuildCache.sheet_hash(sheets[sheet]) for sheet in valid_sheets}
+        params_hash = BuildCache.params_hash(render_params)
+        manifest = BuildCache.load_manifest(folder_name)
+        hits, misses = BuildCache.split_sheets(manifest, sheet_hashes, params_hash, folder_name,
+                                               render_params.formats)
+        if book_path is not None and (misses or not os.path.exists(book_path)):
+            # Единый PDF содержит все листы, поэтому при любом изменении он собирается заново
+            hits, misses = [], list(valid_sheets)
+        rendered_sheets = MainApp.render_sheets(sheets, misses, folder_name, render_params, workers, book_path,
+                                                budget=budget, reference_sheets=reference_sheets or valid_sheets)
+        manifest = BuildCache.update_manifest(manifest, rendered_sheets, sheet_hashes, params_hash)
+        BuildCache.save_manifest(folder_name, manifest)
+        print(f"Инкрементальный режим: без изменений {len(hits)}, перестроено {len(rendered_sheets)}"
+              f" из {len(misses)}")
+
     # Проверка читаемого объекта на существование и верный формат
     @staticmethod
     def run():
-        if len(sys.argv) > 1:
-            file_path = sys.argv[1]
+        args = MainApp.parse_arguments(sys.argv[1:])
+        if args.serve:
+            RenderService.serve(args)
+            return
+        if args.file_path:
+            file_path = args.file_path
         else:
             file_path = input(
                 "Введите название табличного документа с его форматом\n(при его нахождение в одной директории с "
@@ -327,11 +1714,132 @@ class MainApp:
             print("Ошибка: Неверный формат файла.")
             sys.exit(1)
 
-        folder_name = FileUtils.create_unique_folder()
-        valid_sheets = DataProcessor.load_valid_sheets(file_path)
+        params = DataProcessor.read_parameters_from_file('parameters.txt')
+        try:
+            render_params = RenderParameters.from_params(params)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+        if args.list_sheets or args.validate:
+            sys.exit(MainApp.run_inspection(file_path, params, args.validate))
+        if args.stats_only:
+            MainApp.run_statistics(file_path, params)
+            return
+        incremental = args.incremental if args.incremental is not None else params.get('incremental', False)
+        report = args.report if args.report is not None else params.get('report', False)
+        profile = args.cprofile if args.cprofile is not None else params.get('cprofile', False)
+        workers = MainApp.resolve_workers(args.workers, params)
+        if incremental:
+            folder_name = FileUtils.create_stable_folder(file_path)
+        else:
+            folder_name = FileUtils.create_unique_folder()
+
+        if report:
+            Instrumentation.active = Instrumentation()
+        profiler = cProfile.Profile() if profile else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            MainApp.process(file_path, folder_name, params, render_params, incremental, workers,
+                            MainApp.resolve_memory_budget(args.memory_budget, params))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(f'{folder_name}_profile.prof')
+                print(f"Профиль cProfile сохранен в {folder_name}_profile.prof")
+            if report:
+                Instrumentation.active.save_report(f'{folder_name}_report.json', file_path, folder_name, workers)
+                Instrumentation.active = None
+                print(f"Отчет о запуске сохранен в {folder_name}_report.json")
+        # Завершение программы
+        print("Program has done. Thank you for using.")
+        print("parserDiagram_27uvs.")
+
+    # Режимы --list-sheets и --validate: вывод листов "Рис" и результата их проверки, а также времени запуска
+    # программы и проверки. Возвращает код завершения: 1, если есть непрошедшие проверку листы
+    @staticmethod
+    def run_inspection(file_path, params, validate):
+        started = time.perf_counter()
+        try:
+            results = WorkbookInspector.inspect(file_path, FileUtils.parse_columns(params.get('columns')), validate)
+        except Exception as e:
+            print(f"Ошибка при чтении документа: {e}")
+            return 1
+        finished = time.perf_counter()
+        if not results:
+            print("В документе нет листов \"Рис\".")
+        for result in results:
+            name = result['sheet'] if result['sheet'] is not None else "CSV файл"
+            if result['error'] is not None:
+                print(f"{name}: ошибка - {result['error']}")
+                continue
+            line = f"{name}: года {', '.join(str(year) for year in result['years'])}"
+            if validate:
+                line += f"; регионов {result['regions']}, в диаграмме {result['plotted_regions']}"
+            print(line)
+        valid = sum(result['valid'] for result in results)
+        print(f"Валидных листов: {valid} из {len(results)}")
+        print(f"Время запуска: {started - STARTED:.3f} с, {'проверки' if validate else 'чтения листов'}: "
+              f"{finished - started:.3f} с")
+        return 0 if results and valid == len(results) else 1
+
+    # Режим --stats-only: статистика всех листов сохраняется в одну таблицу, matplotlib не загружается
+    @staticmethod
+    def run_statistics(file_path, params):
+        sheets = FileUtils.load_sheets(file_path, FileUtils.parse_columns(params.get('columns')),
+                                       chunk_size=params.get('chunk_size', FileUtils.CSV_CHUNK_SIZE))
+        valid_sheets = DataProcessor.load_valid_sheets(sheets)
+        number = params.get('number', 0)
+        if number != 0 and valid_sheets:
+            valid_sheets = [valid_sheets[number-1]]
+        if not valid_sheets:
+            print("Нет валидных листов для обработки.")
+            return
+        folder_name = FileUtils.create_unique_folder('Statistics')
+        paths = MainApp.export_statistics(sheets, valid_sheets, folder_name, params.get('standard_deviation', 4))
+        print("Статистика сохранена:", ', '.join(paths))
+        print("Program has done. Thank you for using.")
+        print("parserDiagram_27uvs.")
+
+    # Сохранение статистики листов в statistics.csv и, если установлен pyarrow или fastparquet, statistics.parquet
+    @staticmethod
+    def export_statistics(sheets, valid_sheets, folder_name, standard_deviation):
+        tables = []
+        for sheet in valid_sheets:
+            try:
+                region_rows, summary_rows = SeriesStatistics.sheet_table(sheet, sheets[sheet], standard_deviation)
+                tables.extend([region_rows, summary_rows])
+            except Exception as e:
+                logging.error(f"Ошибка при расчете статистики листа '{sheet}': {str(e)}")
+                print(f"Ошибка при расчете статистики листа '{sheet}': {e}")
+        table = pd.DataFrame()
+        if tables:
+            # Целочисленные колонки сохраняются без дробной части и с пропусками в строках другого типа
+            table = pd.concat(tables, ignore_index=True).astype({'rank': 'Int64', 'regions': 'Int64',
+                                                                 'clipped_count': 'Int64', 'clipped': 'boolean'})
+        paths = [os.path.join(folder_name, 'statistics.csv')]
+        table.to_csv(paths[0], index=False, encoding='utf-8-sig')
+        if table.empty:
+            # Статистика не рассчитана ни для одного листа: parquet файл без колонок не сохраняется
+            return paths
+        parquet_path = os.path.join(folder_name, 'statistics.parquet')
+        try:
+            table.astype({'region': str}).to_parquet(parquet_path, index=False)
+            paths.append(parquet_path)
+        except ImportError:
+            # Нет pyarrow или fastparquet
+            pass
+        return paths
+
+    # Загрузка, проверка листов и построение диаграмм
+    @staticmethod
+    def process(file_path, folder_name, params, render_params, incremental, workers, budget=None):
+        # Каждый лист читается из книги один раз и переиспользуется дальше
+        sheets = DiagramAPI.load(file_path, render_params,
+                                 chunk_size=params.get('chunk_size', FileUtils.CSV_CHUNK_SIZE))
+        valid_sheets = book_sheets = DataProcessor.load_valid_sheets(sheets)
         if valid_sheets:
             print("Все валидные листы:", ', '.join(valid_sheets) if valid_sheets[0] else "CSV файл")
-        params = DataProcessor.read_parameters_from_file('parameters.txt')
         number = params.get('number', 0)
         if number != 0:
             valid_sheets = [valid_sheets[number-1]]
@@ -339,25 +1847,24 @@ class MainApp:
         if valid_sheets:
             print("Выбранные валидные листы:", ', '.join(valid_sheets) if valid_sheets[0] else "CSV файл")
             # Параметры генерации диаграмм из файла parameters.txt
-            params = DataProcessor.read_parameters_from_file('parameters.txt')
-            standard_deviation = params.get('standard_deviation', 4)
-            show_original_values = params.get('show_original_values', True)
-            orientation = params.get('orientation', True)
-            width = params.get('width', 10)
-            height = params.get('height', 6)
+            book_path = None
+            if 'book' in render_params.formats:
+                book_path = f'{folder_name}/{FileUtils.file_stem(file_path)}.pdf'
             # Запуск генерации диаграмм
-            for sheet in valid_sheets:
-                DiagramConstructor.make_diagrams(sheet, file_path, folder_name, standard_deviation,
-                                                 show_original_values, orientation, width, height)
+            if incremental:
+                MainApp.render_incremental(sheets, valid_sheets, folder_name, render_params, workers, book_path,
+                                           budget, book_sheets)
+            else:
+                MainApp.render_sheets(sheets, valid_sheets, folder_name, render_params, workers, book_path,
+                                      budget=budget, reference_sheets=book_sheets)
         else:
             print("Нет валидных листов для обработки.")
-        # Завершение программы
-        print("Program has done. Thank you for using.")
-        print("parserDiagram_27uvs.")
 
 
 # Запуск программы
 if __name__ == '__main__':
+    # Необходимо для пула процессов в собранном PyInstaller .exe файле
+    multiprocessing.freeze_support()
     log_file_name = FileUtils.create_unique_log_file()
     logging.basicConfig(filename=log_file_name, level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
     MainApp.run()